@@ -0,0 +1,379 @@
+"""
+性能测试, 全部在进程内完成, 直接调用ASGI应用, 不经过网络
+
+python bench.py routes [--sizes 10 100 1000 5000]
+    比较Router逐个匹配与TrieRouter前缀树查找的路由查找耗时
+python bench.py registration [--sizes 10 100 1000] [--deps 5]
+    导入cbv的耗时, 以及注册N个生成的CBV类(@API)和include_router的耗时
+python bench.py requests [--deps 0 5 20] [--number 2000]
+    CBV与等价的函数endpoint在0/5/20个类依赖下的吞吐量与p50/p99延迟, 包括同步与异步方法
+python bench.py websocket [--number 5000]
+    ws_test.py中的echo WebSocket的每条消息延迟
+python bench.py all
+    以上全部
+
+所有命令都可以加上 --output result.json, 以JSON格式保存结果(包含版本信息), 方便在不同版本间比较
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+import fastapi
+import pydantic
+import starlette
+from starlette.routing import Match
+from fastapi import Depends, FastAPI
+from cbv import API, CBVRouter
+from trie_router import TrieRouter, use_trie_router
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    """samples为单次耗时(秒), 返回p50/p99(微秒)和每秒次数"""
+    samples = sorted(samples)
+    return {
+        "p50_us": round(statistics.median(samples) * 1e6, 3),
+        "p99_us": round(samples[max(int(len(samples) * 0.99) - 1, 0)] * 1e6, 3),
+        "ops_per_s": round(len(samples) / sum(samples), 1),
+    }
+
+
+def _timeit(func: Callable[[], Any], number: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+
+def _http_scope(path: str, method: str = "GET") -> Dict[str, Any]:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("bench", 80),
+    }
+
+
+async def _http_request(app: Any, scope: Dict[str, Any]) -> int:
+    """直接调用ASGI应用完成一次请求, 返回状态码"""
+    status = 0
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(dict(scope), receive, send)
+    return status
+
+
+# ---------------------------------------- routes ----------------------------------------
+
+def build_route_app(size: int) -> FastAPI:
+    """创建一个由size个CBV类(每个类一个get方法)组成的应用, 一半是静态路径, 一半带路径参数"""
+    router = CBVRouter(path="/bench", group_name="Bench")
+    for i in range(size):
+        path = f"/r{i}/{{item_id}}" if i % 2 else f"/r{i}/items"
+
+        def get(self) -> int:
+            return 0
+
+        API(router, path=path, group_name=f"R{i}")(type(f"R{i}", (), {"get": router.method()(get)}))
+    app = FastAPI(openapi_url=None)
+    app.include_router(router)
+    return app
+
+
+def linear_lookup(routes: List[Any], scope: Dict[str, Any]) -> Any:
+    """与starlette中Router.__call__相同的逐个匹配"""
+    partial = None
+    for route in routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route
+        elif match == Match.PARTIAL and partial is None:
+            partial = route
+    return partial
+
+
+def bench_routes(sizes: List[int], number: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        app = build_route_app(size)
+        routes = app.router.routes
+        trie = use_trie_router(app).router
+        assert isinstance(trie, TrieRouter)
+        trie.get_index()
+
+        targets = {
+            "first": "/bench/r0/items",
+            "middle": f"/bench/r{size // 2 + 1}/1",
+            "last": f"/bench/r{size - 1}/items" if (size - 1) % 2 == 0 else f"/bench/r{size - 1}/1",
+            "miss": "/bench/missing/1",
+        }
+        for target, path in targets.items():
+            scope = _http_scope(path)
+            assert linear_lookup(routes, scope) is trie.lookup(scope)[1]
+            for kind, func in (
+                    ("linear", lambda: linear_lookup(routes, scope)),
+                    ("trie", lambda: trie.lookup(scope)),
+            ):
+                result = {"bench": "routes", "routes": len(routes), "target": target, "router": kind}
+                result.update(_timeit(func, number))
+                results.append(result)
+    return results
+
+
+# ------------------------------------- registration -------------------------------------
+
+def _make_dependency(i: int) -> Callable:
+    async def dependency() -> int:
+        return i
+
+    dependency.__name__ = f"dependency_{i}"
+    return dependency
+
+
+DEPENDENCIES = [_make_dependency(i) for i in range(64)]
+
+
+def make_cbv_class(router: CBVRouter, name: str, deps: int, is_async: bool = True) -> type:
+    """生成一个带有deps个类依赖, 以及get/post两个方法的CBV类"""
+    if is_async:
+        async def get(self) -> int:
+            return 0
+    else:
+        def get(self) -> int:
+            return 0
+
+    def post(self) -> int:
+        return 0
+
+    namespace: Dict[str, Any] = {"__annotations__": {}}
+    for i in range(deps):
+        namespace["__annotations__"][f"d{i}"] = int
+        namespace[f"d{i}"] = Depends(DEPENDENCIES[i])
+    namespace["get"] = router.method()(get)
+    namespace["post"] = router.method()(post)
+    return type(name, (), namespace)
+
+
+def make_function_endpoint(deps: int, is_async: bool = True) -> Callable:
+    """与make_cbv_class中get等价的函数endpoint"""
+    if is_async:
+        async def endpoint(**kwargs: Any) -> int:
+            return 0
+    else:
+        def endpoint(**kwargs: Any) -> int:
+            return 0
+
+    setattr(endpoint, "__signature__", inspect.Signature([
+        inspect.Parameter(f"d{i}", inspect.Parameter.KEYWORD_ONLY, default=Depends(DEPENDENCIES[i]), annotation=int)
+        for i in range(deps)
+    ]))
+    return endpoint
+
+
+def bench_import() -> List[Dict[str, Any]]:
+    code = (
+        "import time\n"
+        "start = time.perf_counter(); import fastapi; middle = time.perf_counter()\n"
+        "import cbv; end = time.perf_counter()\n"
+        "print(middle - start, end - middle)"
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    fastapi_time, cbv_time = map(float, output.split())
+    return [
+        {"bench": "import", "module": "fastapi", "ms": round(fastapi_time * 1e3, 3)},
+        {"bench": "import", "module": "cbv", "ms": round(cbv_time * 1e3, 3)},
+    ]
+
+
+def bench_registration(sizes: List[int], deps: int) -> List[Dict[str, Any]]:
+    results = []
+    for size in sizes:
+        for lazy in (False, True):
+            router = CBVRouter(path="/bench", group_name="Bench", lazy=lazy)
+            start = time.perf_counter()
+            for i in range(size):
+                API(router, path=f"/r{i}", group_name=f"R{i}")(make_cbv_class(router, f"R{i}", deps))
+            registered = time.perf_counter()
+            app = FastAPI(openapi_url=None)
+            app.include_router(router)
+            included = time.perf_counter()
+            results.append({
+                "bench": "registration",
+                "classes": size,
+                "deps": deps,
+                "lazy": lazy,
+                "register_ms": round((registered - start) * 1e3, 3),
+                "include_ms": round((included - registered) * 1e3, 3),
+                "per_class_us": round((included - start) / size * 1e6, 3),
+            })
+    return results
+
+
+# --------------------------------------- requests ---------------------------------------
+
+def build_request_app(deps: int, is_async: bool) -> FastAPI:
+    router = CBVRouter(path="/cbv", group_name="CBV")
+    API(router)(make_cbv_class(router, "Bench", deps, is_async))
+    app = FastAPI(openapi_url=None)
+    app.include_router(router)
+    app.add_api_route("/function", make_function_endpoint(deps, is_async))
+    return app
+
+
+def bench_requests(deps_list: List[int], number: int) -> List[Dict[str, Any]]:
+    results = []
+    loop = asyncio.new_event_loop()
+    try:
+        for deps in deps_list:
+            for is_async in (True, False):
+                app = build_request_app(deps, is_async)
+                for kind, path in (("function", "/function"), ("cbv", "/cbv")):
+                    scope = _http_scope(path)
+                    assert loop.run_until_complete(_http_request(app, scope)) == 200
+
+                    async def run() -> List[float]:
+                        samples = []
+                        for _ in range(number):
+                            start = time.perf_counter()
+                            await _http_request(app, scope)
+                            samples.append(time.perf_counter() - start)
+                        return samples
+
+                    result = {
+                        "bench": "requests",
+                        "endpoint": kind,
+                        "deps": deps,
+                        "method": "async" if is_async else "sync",
+                    }
+                    result.update(_summary(loop.run_until_complete(run())))
+                    results.append(result)
+    finally:
+        loop.close()
+    return results
+
+
+# --------------------------------------- websocket --------------------------------------
+
+def bench_websocket(number: int) -> List[Dict[str, Any]]:
+    import ws_test
+
+    app = FastAPI(openapi_url=None)
+    app.include_router(ws_test.router)
+
+    async def run() -> List[float]:
+        inbox: asyncio.Queue = asyncio.Queue()
+        outbox: asyncio.Queue = asyncio.Queue()
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": "/ws",
+            "raw_path": b"/ws",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 12345),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        await inbox.put({"type": "websocket.connect"})
+        task = asyncio.ensure_future(app(scope, inbox.get, outbox.put))
+        assert (await outbox.get())["type"] == "websocket.accept"
+
+        samples = []
+        for i in range(number):
+            start = time.perf_counter()
+            await inbox.put({"type": "websocket.receive", "text": f"message {i}"})
+            message = await outbox.get()
+            samples.append(time.perf_counter() - start)
+        assert message["text"] == f"Message text was: message {number - 1}"
+        await inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await task
+        return samples
+
+    loop = asyncio.new_event_loop()
+    try:
+        samples = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    result = {"bench": "websocket", "endpoint": "ws_test.WebSocketTest", "messages": number}
+    result.update(_summary(samples))
+    return [result]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--output", help="以JSON格式保存结果")
+    subparsers = parser.add_subparsers(dest="bench", required=True)
+
+    routes = subparsers.add_parser("routes", parents=[common], help="路由查找耗时")
+    routes.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    routes.add_argument("--number", type=int, default=2000)
+
+    registration = subparsers.add_parser("registration", parents=[common], help="导入与注册耗时")
+    registration.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    registration.add_argument("--deps", type=int, default=5)
+
+    requests = subparsers.add_parser("requests", parents=[common], help="CBV与函数endpoint的请求耗时")
+    requests.add_argument("--deps", type=int, nargs="+", default=[0, 5, 20])
+    requests.add_argument("--number", type=int, default=2000)
+
+    websocket = subparsers.add_parser("websocket", parents=[common], help="WebSocket echo的消息耗时")
+    websocket.add_argument("--number", type=int, default=5000)
+
+    subparsers.add_parser("all", parents=[common], help="全部测试, 使用默认参数")
+
+    args = parser.parse_args()
+    results: List[Dict[str, Any]] = []
+    if args.bench in ("routes", "all"):
+        results += bench_routes(getattr(args, "sizes", [10, 100, 1000, 5000]), getattr(args, "number", 2000))
+    if args.bench in ("registration", "all"):
+        results += bench_import()
+        results += bench_registration(getattr(args, "sizes", [10, 100, 1000]), getattr(args, "deps", 5))
+    if args.bench in ("requests", "all"):
+        results += bench_requests(getattr(args, "deps", [0, 5, 20]), getattr(args, "number", 2000))
+    if args.bench in ("websocket", "all"):
+        results += bench_websocket(getattr(args, "number", 5000))
+
+    for result in results:
+        print("  ".join(f"{key}={value}" for key, value in result.items()))
+    if args.output:
+        meta = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "fastapi": fastapi.__version__,
+            "starlette": starlette.__version__,
+            "pydantic": pydantic.VERSION,
+        }
+        with open(args.output, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,77 @@
+import ast
+import asyncio
+import collections.abc
 import inspect
-from typing import Any, Callable, Dict, List, Optional, Sequence, Type, Union, get_type_hints
-from pydantic import typing
-from pydantic.typing import is_classvar
+import json
+import logging
+import textwrap
+import time
+import types
+import weakref
+from urllib.parse import urlencode
+from contextlib import AsyncExitStack
+from contextvars import ContextVar
+from copy import copy
+from typing import (
+    Any, AsyncIterator, Callable, ClassVar, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Type, Union
+)
+from pydantic import BaseModel, ValidationError, typing
+from pydantic.fields import ModelField
+from pydantic.typing import is_classvar, resolve_annotations
+from pydantic.utils import lenient_issubclass
 from starlette import routing, status
-from starlette.responses import Response
+from starlette.background import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from starlette.routing import Route, WebSocketRoute, Router
-from starlette.types import ASGIApp, Message
-from starlette.websockets import WebSocket
-from starlette.endpoints import WebSocketEndpoint
-from fastapi import Depends
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.websockets import WebSocket, WebSocketState
+from fastapi import Body, Depends
 from fastapi import params
-from fastapi.encoders import DictIntStrAny, SetIntStr
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import (
+    get_dependant, get_flat_dependant, is_async_gen_callable, is_coroutine_callable, is_gen_callable, solve_dependencies
+)
+from fastapi.encoders import DictIntStrAny, SetIntStr, jsonable_encoder
+from fastapi.exceptions import HTTPException, RequestValidationError, WebSocketRequestValidationError
 from fastapi.routing import APIRoute, APIRouter, APIWebSocketRoute
+from fastapi.utils import create_response_field
 
-# 如果使用, 可以尝试修正下包名
+# 由router.method()记录在函数上的额外配置
+CBV_OPTIONS_KEY = "__cbv_options__"
+
+logger = logging.getLogger(__name__)
+
+# 作为包使用时使用相对导入, 直接复制到项目中时使用绝对导入
+try:
+    from .temp_router import DEFAULT_RESPONSE_CLASS, TempRoute, TempRouter, TempWebSocketRoute, get_response_class
+except ImportError:
+    from temp_router import DEFAULT_RESPONSE_CLASS, TempRoute, TempRouter, TempWebSocketRoute, get_response_class
+try:
+    from .cbv_cache import Cache, CacheEntry, etag_matches, make_etag
+except ImportError:
+    from cbv_cache import Cache, CacheEntry, etag_matches, make_etag
+try:
+    from .cbv_executor import CBVExecutor, get_executor
+except ImportError:
+    from cbv_executor import CBVExecutor, get_executor
+try:
+    from .cbv_resource import Resource, register_resources
+except ImportError:
+    from cbv_resource import Resource, register_resources
 try:
-    from .temp_router import TempRoute
-except:
-    TempRoute = None
+    from .cbv_metrics import CBVMetrics
+except ImportError:
+    from cbv_metrics import CBVMetrics
+try:
+    from .ws_codec import Codec, CodecError, get_codec
+except ImportError:
+    from ws_codec import Codec, CodecError, get_codec
+try:
+    from .ws_hub import ALL, Hub
+except ImportError:
+    from ws_hub import ALL, Hub
 
 
 class CBVRouter(Router):
@@ -33,10 +87,13 @@ class CBVRouter(Router):
             redirect_slashes: bool = True,
             default: Optional[ASGIApp] = None,
             dependency_overrides_provider: Optional[Any] = None,
-            route_class: Type[APIRoute] = TempRoute or APIRoute,
+            route_class: Type[APIRoute] = TempRoute,
             default_response_class: Optional[Type[Response]] = None,
             on_startup: Optional[Sequence[Callable]] = None,
             on_shutdown: Optional[Sequence[Callable]] = None,
+            lazy: bool = False,
+            metrics: Optional[CBVMetrics] = None,
+            executor: Optional[Union[str, CBVExecutor]] = None,
     ) -> None:
         """
         :param group_name: 配置一个CBV的方法们独有的名字，方便标识。
@@ -44,7 +101,17 @@ class CBVRouter(Router):
         :param tags: 整合参数，默认值是group_name
         :param description: 整合参数，只能在此输入
         :param summary: 整合参数，只能在此输入，默认值是group_name_方法名
+        :param lazy: @API只处理类本身(__init__, __slots__), 路由的创建, endpoint签名的修改等
+            推迟到第一次读取routes时(一般是被include_router时)进行
+            默认的route_class为TempRoute, 依赖分析和response_model的处理只在被include_router时进行一次
+        :param metrics: 记录各方法每个阶段(类依赖解析, 实例化, 方法本身)耗时的CBVMetrics, 默认不记录
+        :param executor: 同步方法与同步依赖(包括类的实例化)使用的CBVExecutor(kind="thread")或其名字,
+            默认使用Starlette共用的线程池; 关闭时(on_shutdown)会关闭该池
         """
+        self.lazy = lazy
+        self.metrics = metrics
+        self.executor = _get_thread_executor(executor)
+        self.pending: List[Callable[[], None]] = []
         super().__init__(
             routes=routes,
             redirect_slashes=redirect_slashes,
@@ -54,13 +121,43 @@ class CBVRouter(Router):
         )
         self.dependency_overrides_provider = dependency_overrides_provider
         self.route_class = route_class
-        self.default_response_class = default_response_class
+        self.default_response_class = default_response_class or DEFAULT_RESPONSE_CLASS
+        if self.executor is not None:
+            self.add_event_handler("shutdown", self.executor.shutdown)
 
         self.path = path
         self.name = group_name
         self.tags = tags or [group_name]
         self.description = description
         self.summary = summary
+        # endpoint -> 所属的类, 类 -> 其路由, 一个CBVRouter可以注册多个类
+        self.endpoints: Dict[Callable, Type[Any]] = {}
+        self.classes: Dict[Type[Any], List[routing.BaseRoute]] = {}
+        # router.method(cache=...)的路由: (Cache, namespace)
+        self.caches: List[Tuple[Cache, str]] = []
+        # cbv_openapi生成的schema片段, 由路由与模型的名字索引
+        self.openapi_fragments: Dict[Any, Any] = {}
+
+    @property
+    def routes(self) -> List[routing.BaseRoute]:
+        if self.pending:
+            self.compile()
+        return self._routes
+
+    @routes.setter
+    def routes(self, routes: List[routing.BaseRoute]) -> None:
+        self._routes = routes
+
+    def compile(self) -> None:
+        """处理lazy模式下推迟的类"""
+        pending, self.pending = self.pending, []
+        for register in pending:
+            register()
+
+    async def invalidate_cache(self) -> None:
+        """清空本router上所有路由的响应缓存"""
+        for cache, namespace in self.caches:
+            await cache.backend.clear(namespace)
 
     def method(
             self,
@@ -82,53 +179,765 @@ class CBVRouter(Router):
             response_class: Optional[Type[Response]] = None,
             name: Optional[str] = None,
             callbacks: Optional[List[APIRoute]] = None,
+            uses: Optional[Union[Sequence[str], str]] = None,
+            cache: Optional[Cache] = None,
+            invalidates_cache: bool = False,
+            validate_response: Optional[bool] = None,
+            stream: str = "ndjson",
+            executor: Optional[Union[str, CBVExecutor]] = None,
     ) -> Callable:
+        """
+        :param uses: 该方法用到的类依赖, 其余类依赖不会被解析, 仅对scope="request"生效
+            None: 默认值, 解析全部类依赖
+            ["x", "y"]: 只解析列出的类依赖
+            "auto": 分析方法(以及其调用的其他方法, property, __init__)中的self.<attr>, 自动确定
+                    无法确定时(例如self被作为参数传出, 或无法获取源码)退回到解析全部
+        :param cache: 缓存该方法的响应, 见cbv_cache.Cache
+        :param invalidates_cache: 该方法成功(状态码小于400)后, 清空同一个CBVRouter上的所有响应缓存
+        :param validate_response: 是否用response_model重新校验返回值
+            None: 默认值, 返回值恰好是response_model(或List[response_model]中每一项恰好是该模型)的实例时跳过校验,
+                  直接按response_model_*的配置序列化, 其余情况与FastAPI相同
+            False: 总是跳过校验, 直接按response_model_*的配置序列化
+            True: 总是校验, 与FastAPI相同
+            方法(或依赖)声明了Response参数时总是校验, 以保留其设置的状态码与headers
+        :param stream: 方法是生成器或异步生成器时, 以流的形式逐项输出
+            "ndjson": 每项一行(application/x-ndjson), "json": 逐步写出的json数组
+            每一项按response_model的元素类型(例如List[Item]中的Item)校验与序列化, validate_response同样适用
+        :param executor: 该同步方法本身使用的CBVExecutor或其名字, 可以是进程池(kind="process"),
+            优先于API与CBVRouter的executor, 依赖仍按后者解析
+        """
+        assert stream in ("ndjson", "json"), "stream只能是ndjson或json"
+        assert uses is None or uses == "auto" or not isinstance(uses, str), "uses只能是None, 'auto'或名字的列表"
+
         def decorator(func: Callable) -> Callable:
             method = getattr(func, "__name__", None)
             assert method, "装饰器使用方式错误"
             assert method in ['get', 'post', 'put', 'delete', 'options', 'head', 'patch', 'trace'], \
                 "请将方法名配置为' HTTP METHOD '中的一个"
 
-            tags.extend(self.tags)
-
-            route_class = self.route_class
-            route = route_class(
-                self.path,
-                endpoint=func,
-                response_model=response_model,
-                status_code=status_code,
-
-                tags=tags,
-                description=self.description,
-                methods=[method],
-                operation_id=f'{self.name}_{self.path[1:]}_{method}',
-                summary=summary or f'{self.name} _ {method}',
-
-                dependencies=dependencies,
-                deprecated=deprecated,
-                response_description=response_description,
-                responses=responses or {},
-                response_model_include=response_model_include,
-                response_model_exclude=response_model_exclude,
-                response_model_by_alias=response_model_by_alias,
-                response_model_exclude_unset=response_model_exclude_unset,
-                response_model_exclude_defaults=response_model_exclude_defaults,
-                response_model_exclude_none=response_model_exclude_none,
-                include_in_schema=include_in_schema,
-                response_class=response_class or self.default_response_class,
-                name=name,
-                dependency_overrides_provider=self.dependency_overrides_provider,
-                callbacks=callbacks,
-            )
-            route.__class__ = APIRoute
-            self.routes.append(route)
+            setattr(func, CBV_OPTIONS_KEY, {
+                "method": method,
+                "uses": uses,
+                "cache": cache,
+                "invalidates_cache": invalidates_cache,
+                "validate_response": validate_response,
+                "executor": None if executor is None else get_executor(executor),
+                "stream": stream if inspect.isasyncgenfunction(func) or inspect.isgeneratorfunction(func) else None,
+                "route": dict(
+                    response_model=response_model,
+                    status_code=status_code,
+                    summary=summary,
+                    tags=list(tags or []),
+                    dependencies=dependencies,
+                    deprecated=deprecated,
+                    response_description=response_description,
+                    responses=responses or {},
+                    response_model_include=response_model_include,
+                    response_model_exclude=response_model_exclude,
+                    response_model_by_alias=response_model_by_alias,
+                    response_model_exclude_unset=response_model_exclude_unset,
+                    response_model_exclude_defaults=response_model_exclude_defaults,
+                    response_model_exclude_none=response_model_exclude_none,
+                    include_in_schema=include_in_schema,
+                    response_class=response_class,
+                    name=name,
+                    callbacks=callbacks,
+                ),
+            })
 
             return func
 
         return decorator
 
+    def add_cbv_route(
+            self, cls: Type[Any], func: Callable, path: str, group_name: str, executor: Optional[CBVExecutor] = None
+    ) -> routing.BaseRoute:
+        """
+        使用router.method()记录在func上的配置创建路由, 并记录func所属的类
+        """
+        assert func not in self.endpoints, f"{func.__qualname__}已经被注册过"
+        options = getattr(func, CBV_OPTIONS_KEY)
+        method = options["method"]
+        kwargs = dict(options["route"])
+        kwargs["tags"] = kwargs["tags"] + self.tags
+        kwargs["summary"] = kwargs["summary"] or f'{group_name} _ {method}'
+        kwargs["response_class"] = kwargs["response_class"] or self.default_response_class
+
+        route = self.route_class(
+            path,
+            endpoint=func,
+            description=self.description,
+            methods=[method],
+            operation_id=f'{group_name}_{path[1:]}_{method}',
+            dependency_overrides_provider=self.dependency_overrides_provider,
+            **kwargs
+        )
+        options["router"] = self
+        options["metrics"] = self.metrics
+        options["class_executor"] = executor or self.executor
+        for used in (executor, options["executor"]):
+            if used is not None and used.shutdown not in self.on_shutdown:
+                self.add_event_handler("shutdown", used.shutdown)
+        if options["cache"] is not None:
+            options["cache_namespace"] = f"{method.upper()} {path}"
+            options["cache_vary"] = _get_vary_call(cls, options["cache"].vary)
+            self.caches.append((options["cache"], options["cache_namespace"]))
+        if options["invalidates_cache"]:
+            options["invalidate"] = self.invalidate_cache
+        route.__class__ = CBVRoute
+        self.routes.append(route)
+        self.endpoints[func] = cls
+        self.classes.setdefault(cls, []).append(route)
+        return route
+
+
+class _PhaseTimer:
+    __slots__ = ("start", "init_start", "init_end", "method_start", "method_end")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.init_start = self.init_end = self.method_start = self.method_end = None
+
+
+# 当前请求的_PhaseTimer, 只在启用metrics时设置
+_phase_timer: ContextVar[Optional[_PhaseTimer]] = ContextVar("cbv_phase_timer", default=None)
+
+
+class CBVRoute(APIRoute):
+    """
+    CBV方法的路由, 被include_router时依然会以此类创建
+    额外的功能由router.method()和CBVRouter记录在endpoint上的配置(CBV_OPTIONS_KEY)决定, 未启用时与APIRoute完全相同
+    """
+
+    def get_route_handler(self) -> Callable:
+        options = getattr(self.endpoint, CBV_OPTIONS_KEY, None) or {}
+        if options.get("instances") is not None:
+            # scope为"app"/"pooled"的类, 启动时按此app的dependency_overrides创建实例
+            options["instances"].bind(self.dependency_overrides_provider)
+        self._prepare_concurrent_factory(options.get("class_executor"))
+        if options.get("class_executor") is not None or options.get("executor") is not None:
+            self._use_executors(options.get("class_executor"), options.get("executor"))
+        if options.get("metrics") is not None:
+            self._instrument_dependant()
+        if options.get("stream") is not None:
+            encode = _get_item_encoder(self, options.get("validate_response"))
+            self.dependant.call = _streaming_call(self.dependant.call, encode, options["stream"], self.status_code)
+        else:
+            serializer = _get_response_serializer(self, options.get("validate_response"))
+            if serializer is not None:
+                self.dependant.call = _trusted_call(self.dependant.call, serializer)
+        handler = super().get_route_handler()
+        if options.get("cache") is not None:
+            vary = options["cache_vary"]
+            vary_dependant = None if vary is None else get_dependant(path=self.path_format, call=vary)
+            if vary_dependant is not None:
+                _use_presolved(self.dependant.dependencies, _get_dependency_calls(vary_dependant))
+            handler = _cached_handler(
+                handler, options["cache"], options["cache_namespace"], vary_dependant,
+                self._get_guard_dependant(), self.dependency_overrides_provider
+            )
+        if options.get("invalidate") is not None:
+            handler = _invalidating_handler(handler, options["invalidate"])
+        # 批量接口直接调用handler, 不经过ASGI
+        self.handler = handler
+        return handler
+
+    def _get_guard_dependant(self) -> Optional[Dependant]:
+        """
+        除self(类实例)之外的依赖: 路由的dependencies(包括include_router添加的), 方法参数中的Depends
+        缓存命中时仍然解析它们, 认证等检查不会被跳过
+        """
+        self_name = next(iter(inspect.signature(self.endpoint).parameters))
+        dependencies = [dependant for dependant in self.dependant.dependencies if dependant.name != self_name]
+        if not dependencies:
+            return None
+        return Dependant(path=self.path_format, dependencies=dependencies)
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs: Any) -> None:
+        super().__init__(path, endpoint, **kwargs)
+        options = getattr(self.endpoint, CBV_OPTIONS_KEY, None) or {}
+        metrics = options.get("metrics")
+        if metrics is not None:
+            self.app = _timed_app(self.app, metrics, f"{','.join(sorted(self.methods))} {self.path_format}")
+
+    def _prepare_concurrent_factory(self, class_executor: Optional[CBVExecutor]) -> None:
+        """
+        API(concurrent=True)时self的依赖是_get_concurrent_factory的结果, 此时才知道路由的全部依赖
+        (方法参数中的Depends, 路由与include_router的dependencies), 按路由重新生成:
+        与它们共用依赖函数的类依赖不参与分组, 由外层解析, 与其他依赖共用同一个缓存;
+        分组内的同步依赖与实例化交给class_executor
+        """
+        self_name = next(iter(inspect.signature(self.endpoint).parameters), None)
+        for index, dependant in enumerate(self.dependant.dependencies):
+            if dependant.name == self_name:
+                break
+        else:
+            return
+        info = getattr(dependant.call, "__cbv_concurrent__", None)
+        if info is None:
+            return
+        build, grouped_calls = info
+        other_calls: Set[Any] = set()
+        for other in self.dependant.dependencies:
+            if other is not dependant:
+                other_calls |= _get_dependency_calls(other) | {other.call}
+        if not grouped_calls & other_calls and class_executor is None:
+            return
+        factory = _get_concurrent_factory(build, self.path_format, other_calls, class_executor)
+        self.dependant.dependencies[index] = get_dependant(path=self.path_format, call=factory, name=self_name)
+
+    def _use_executors(self, class_executor: Optional[CBVExecutor], method_executor: Optional[CBVExecutor]) -> None:
+        """
+        将同步的依赖(包括类本身)交给class_executor, 同步的方法交给method_executor或class_executor
+        同一个依赖函数只包装一次, 包装后与原函数相等, 依赖的缓存与dependency_overrides依然有效
+        """
+        if class_executor is not None:
+            _use_dependency_executor(self.dependant.dependencies, class_executor)
+
+        executor = method_executor or class_executor
+        call = self.dependant.call
+        if executor is not None and not is_coroutine_callable(call) \
+                and not is_gen_callable(call) and not is_async_gen_callable(call):
+            target = getattr(call, "__cbv_function__", call) if executor.kind == "process" else call
+
+            async def run(*args: Any, **kwargs: Any) -> Any:
+                return await executor.run(target, args, kwargs)
+
+            setattr(run, "__signature__", inspect.signature(call))
+            self.dependant.call = run
 
-def API(router: CBVRouter):
+    def _instrument_dependant(self) -> None:
+        """包装endpoint与self的依赖, 记录实例化与方法本身的开始和结束时间"""
+        self.dependant.call = _timed_call(self.dependant.call, "method_start", "method_end")
+        self_name = next(iter(inspect.signature(self.endpoint).parameters))
+        for sub_dependant in self.dependant.dependencies:
+            call = sub_dependant.call
+            if sub_dependant.name == self_name and not inspect.isasyncgenfunction(call) \
+                    and not inspect.isgeneratorfunction(call):
+                sub_dependant.call = _timed_call(call, "init_start", "init_end")
+
+
+# 与JSONResponse.render相同的输出格式
+_JSON_OPTIONS: Dict[str, Any] = dict(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _get_encoder_options(route: APIRoute) -> Dict[str, Any]:
+    return dict(
+        include=route.response_model_include,
+        exclude=route.response_model_exclude,
+        by_alias=route.response_model_by_alias,
+        exclude_unset=route.response_model_exclude_unset,
+        exclude_defaults=route.response_model_exclude_defaults,
+        exclude_none=route.response_model_exclude_none,
+    )
+
+
+def _get_item_encoder(route: APIRoute, validate_response: Optional[bool]) -> Callable[[Any], str]:
+    """
+    流式输出中单项的编码函数: 项 -> json文本
+    response_model为List[Item]等时按Item校验, 否则按response_model本身; 校验失败时抛出ValidationError,
+    此时响应头已经发出, 连接会被中断
+    """
+    options = _get_encoder_options(route)
+    item_type = route.response_model
+    if getattr(item_type, "__origin__", None) in (list, List, Sequence, collections.abc.Iterable,
+                                                   collections.abc.Iterator, collections.abc.AsyncIterator):
+        item_type = item_type.__args__[0]
+    if item_type is None or validate_response is False:
+        field = None
+    else:
+        field = create_response_field(name="item", type_=item_type)
+    trusted = validate_response is None and lenient_issubclass(item_type, BaseModel)
+
+    def encode(item: Any) -> str:
+        if trusted and type(item) is item_type:
+            return item.json(**options, **_JSON_OPTIONS)
+        if field is not None:
+            item, errors = field.validate(item, {}, loc=("response",))
+            if errors:
+                raise ValidationError([errors], field.type_)
+        if isinstance(item, BaseModel):
+            return item.json(**options, **_JSON_OPTIONS)
+        return json.dumps(jsonable_encoder(item, **options), **_JSON_OPTIONS)
+
+    return encode
+
+
+def _streaming_call(call: Callable, encode: Callable[[Any], str], stream: str, status_code: int) -> Callable:
+    """
+    包装生成器endpoint, 返回逐项编码的StreamingResponse
+    输出按_STREAM_CHUNK_SIZE合并后再发送; 同步生成器由StreamingResponse在线程池中迭代
+    """
+    media_type = "application/x-ndjson" if stream == "ndjson" else JSONResponse.media_type
+    if stream == "ndjson":
+        head, separator, tail = "", "\n", "\n"
+    else:
+        head, separator, tail = "[", ",", "]"
+
+    async def encode_async(items: AsyncIterator[Any]) -> AsyncIterator[str]:
+        parts, size, first = [head], len(head), True
+        async for item in items:
+            text = encode(item) if first else separator + encode(item)
+            first = False
+            parts.append(text)
+            size += len(text)
+            if size >= _STREAM_CHUNK_SIZE:
+                yield "".join(parts)
+                parts, size = [], 0
+        if not first or stream == "json":
+            parts.append(tail)
+        yield "".join(parts)
+
+    def encode_sync(items: Iterator[Any]) -> Iterator[str]:
+        parts, size, first = [head], len(head), True
+        for item in items:
+            text = encode(item) if first else separator + encode(item)
+            first = False
+            parts.append(text)
+            size += len(text)
+            if size >= _STREAM_CHUNK_SIZE:
+                yield "".join(parts)
+                parts, size = [], 0
+        if not first or stream == "json":
+            parts.append(tail)
+        yield "".join(parts)
+
+    async def streaming(*args: Any, **kwargs: Any) -> Any:
+        items = call(*args, **kwargs)
+        if isinstance(items, Response):
+            return items
+        body = encode_async(items) if inspect.isasyncgen(items) else encode_sync(items)
+        return StreamingResponse(body, status_code=status_code, media_type=media_type)
+
+    setattr(streaming, "__signature__", inspect.signature(call))
+    return streaming
+
+
+def _get_response_serializer(route: APIRoute, validate_response: Optional[bool]) -> Optional[Callable]:
+    """
+    预先生成跳过response_model校验的序列化函数: 返回值 -> Response, 不能处理时返回None(交给FastAPI)
+    include/exclude等配置在此时确定; 默认的JSONResponse直接由pydantic输出json, 不经过jsonable_encoder
+    """
+    if validate_response or route.response_model is None:
+        return None
+    if any(x.response_param_name for x in [route.dependant] + get_flat_dependant(route.dependant).dependencies):
+        return None
+
+    options = _get_encoder_options(route)
+    json_options = _JSON_OPTIONS
+    response_class, status_code = get_response_class(route.response_class), route.status_code
+    is_json = response_class is JSONResponse
+    model = route.response_model
+    item_model = None
+    if getattr(model, "__origin__", None) in (list, List, Sequence):
+        item_model = model.__args__[0]
+        model = None
+    if not lenient_issubclass(model, BaseModel):
+        model = None
+    if not lenient_issubclass(item_model, BaseModel):
+        item_model = None
+
+    def generic(result: Any) -> Optional[Response]:
+        if validate_response is None:
+            return None
+        return response_class(content=jsonable_encoder(result, **options), status_code=status_code)
+
+    if model is not None:
+        def serialize(result: Any) -> Optional[Response]:
+            if type(result) is not model:
+                return generic(result)
+            if is_json:
+                body = result.json(**options, **json_options)
+                return Response(body, status_code=status_code, media_type=JSONResponse.media_type)
+            return response_class(content=jsonable_encoder(result, **options), status_code=status_code)
+    elif item_model is not None:
+        encoder = item_model.__json_encoder__
+
+        def serialize(result: Any) -> Optional[Response]:
+            if not isinstance(result, (list, tuple)) or any(type(x) is not item_model for x in result):
+                return generic(result)
+            if is_json:
+                body = json.dumps([x.dict(**options) for x in result], default=encoder, **json_options)
+                return Response(body, status_code=status_code, media_type=JSONResponse.media_type)
+            return response_class(content=jsonable_encoder(result, **options), status_code=status_code)
+    elif validate_response is None:
+        return None
+    else:
+        serialize = generic
+    return serialize
+
+
+def _trusted_call(call: Callable, serializer: Callable) -> Callable:
+    """包装endpoint, 能直接序列化的返回值转换为Response, FastAPI会原样返回Response, 从而跳过校验"""
+    if is_coroutine_callable(call):
+        async def trusted(*args: Any, **kwargs: Any) -> Any:
+            result = await call(*args, **kwargs)
+            response = None if isinstance(result, Response) else serializer(result)
+            return result if response is None else response
+    else:
+        def trusted(*args: Any, **kwargs: Any) -> Any:
+            result = call(*args, **kwargs)
+            response = None if isinstance(result, Response) else serializer(result)
+            return result if response is None else response
+
+    setattr(trusted, "__signature__", inspect.signature(call))
+    return trusted
+
+
+def _get_vary_call(cls: Type[Any], names: Sequence[str]) -> Optional[Callable]:
+    """只包含names中的类依赖的函数, 返回{名字: 值}, 用于在不实例化类的情况下计算缓存键"""
+    if not names:
+        return None
+    dependency_names = getattr(cls, "__cbv_dependencies__")
+    for name in names:
+        assert name in dependency_names, f"{cls.__name__}中没有名为{name}的类依赖"
+
+    def vary(**kwargs: Any) -> Dict[str, Any]:
+        return kwargs
+
+    signature = getattr(cls, "__signature__")
+    setattr(vary, "__signature__", signature.replace(parameters=[
+        x.replace(kind=inspect.Parameter.KEYWORD_ONLY) for x in signature.parameters.values() if x.name in names
+    ]))
+    return vary
+
+
+def _cached_handler(
+        handler: Callable,
+        cache: Cache,
+        namespace: str,
+        vary_dependant: Optional[Dependant],
+        guard_dependant: Optional[Dependant],
+        dependency_overrides_provider: Optional[Any],
+) -> Callable:
+    """
+    命中时直接以缓存的body构造响应, 否则调用handler并缓存2xx的响应
+    命中时仍会解析guard_dependant(路由级的依赖), 其中抛出的HTTPException(例如401)照常返回
+    guard或vary的依赖解析失败时不使用缓存, 由handler返回相应的错误
+    """
+    backend = cache.backend
+
+    async def app(request: Request) -> Response:
+        values: Dict[str, Any] = {}
+        dependency_cache: Dict[Any, Any] = {}
+        if vary_dependant is not None:
+            values, errors, _, _, dependency_cache = await solve_dependencies(
+                request=request,
+                dependant=vary_dependant,
+                dependency_overrides_provider=dependency_overrides_provider,
+            )
+            if errors:
+                return await handler(request)
+        key = cache.key(request, values)
+        entry = await backend.get(namespace, key)
+        if entry is None:
+            token = _presolved.set({cache_key[0]: value for cache_key, value in dependency_cache.items()})
+            try:
+                response = await handler(request)
+            finally:
+                _presolved.reset(token)
+            body = getattr(response, "body", None)
+            if body is None or not 200 <= response.status_code < 300 or "set-cookie" in response.headers:
+                return response
+            etag = make_etag(body)
+            response.headers["etag"] = etag
+            entry = CacheEntry(body, response.status_code, list(response.raw_headers), etag)
+            await backend.set(namespace, key, entry, cache.ttl)
+        else:
+            # 未命中时由handler解析, 只在命中时单独解析, 避免同一请求中执行两次
+            if guard_dependant is not None:
+                _, errors, *_ = await solve_dependencies(
+                    request=request,
+                    dependant=guard_dependant,
+                    dependency_overrides_provider=dependency_overrides_provider,
+                    dependency_cache=dependency_cache,
+                )
+                if errors:
+                    return await handler(request)
+            response = Response(entry.body, status_code=entry.status_code)
+            response.raw_headers = list(entry.headers)
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, entry.etag):
+            return Response(status_code=304, headers={"etag": entry.etag})
+        return response
+
+    return app
+
+
+def _invalidating_handler(handler: Callable, invalidate: Callable) -> Callable:
+    async def app(request: Request) -> Response:
+        response = await handler(request)
+        if response.status_code < 400:
+            await invalidate()
+        return response
+
+    return app
+
+
+def _use_dependency_executor(dependencies: List[Dependant], executor: CBVExecutor) -> None:
+    """将依赖树中同步的依赖交给executor, 同一个依赖函数只包装一次"""
+    wrappers: Dict[int, _ExecutorCall] = {}
+    dependants = list(dependencies)
+    while dependants:
+        dependant = dependants.pop()
+        dependants.extend(dependant.dependencies)
+        call = dependant.call
+        if call is None or is_coroutine_callable(call) or is_gen_callable(call) \
+                or is_async_gen_callable(call) or isinstance(call, _ExecutorCall):
+            continue
+        if id(call) not in wrappers:
+            wrappers[id(call)] = _ExecutorCall(executor, call)
+        dependant.call = wrappers[id(call)]
+
+
+# 缓存未命中时, 计算缓存键时已经解析的依赖: 依赖函数 -> 值, 由_PresolvedCall取用
+_presolved: ContextVar[Optional[Dict[Any, Any]]] = ContextVar("cbv_presolved", default=None)
+
+
+class _PresolvedCall:
+    """
+    vary的依赖树中的函数, 缓存未命中时直接返回计算缓存键时的结果, 同一个请求中不再调用第二次
+    hash与相等性和原函数相同(同_ExecutorCall)
+    """
+
+    __slots__ = ("call", "__signature__")
+
+    def __init__(self, call: Callable):
+        self.call = call
+        self.__signature__ = inspect.signature(call)
+
+    async def __call__(self, **kwargs: Any) -> Any:
+        presolved = _presolved.get()
+        if presolved is not None and self.call in presolved:
+            return presolved[self.call]
+        if is_coroutine_callable(self.call):
+            return await self.call(**kwargs)
+        return await run_in_threadpool(self.call, **kwargs)
+
+    def __hash__(self) -> int:
+        return hash(self.call)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, _PresolvedCall):
+            return self.call == other.call
+        return self.call == other
+
+
+def _use_presolved(dependencies: List[Dependant], calls: Set[Any]) -> None:
+    """
+    将依赖树(包括_get_concurrent_factory内部的分组)中属于calls的函数包装为_PresolvedCall
+    生成器依赖的清理与其解析绑定, 不做包装
+    """
+    dependants = list(dependencies)
+    while dependants:
+        dependant = dependants.pop()
+        dependants.extend(dependant.dependencies)
+        call = dependant.call
+        dependants.extend(getattr(call, "__cbv_dependants__", ()))
+        if call in calls and not isinstance(call, _PresolvedCall) \
+                and not is_gen_callable(call) and not is_async_gen_callable(call):
+            dependant.call = _PresolvedCall(call)
+
+
+class _ExecutorCall:
+    """
+    在CBVExecutor中运行的同步依赖, 对FastAPI而言是协程函数
+    hash与相等性和原函数相同, 以便依赖缓存和dependency_overrides按原函数查找
+    """
+
+    __slots__ = ("executor", "call", "__signature__")
+
+    def __init__(self, executor: CBVExecutor, call: Callable):
+        self.executor = executor
+        self.call = call
+        self.__signature__ = inspect.signature(call)
+
+    async def __call__(self, **kwargs: Any) -> Any:
+        return await self.executor.run(self.call, (), kwargs)
+
+    def __hash__(self) -> int:
+        return hash(self.call)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, _ExecutorCall):
+            return self.call == other.call
+        return self.call == other
+
+
+def _get_thread_executor(executor: Optional[Union[str, CBVExecutor]]) -> Optional[CBVExecutor]:
+    if executor is None:
+        return None
+    executor = get_executor(executor)
+    assert executor.kind == "thread", "CBVRouter与API的executor只能是线程池, 进程池请用于router.method(executor=...)"
+    return executor
+
+
+def _timed_call(call: Callable, start: str, end: str) -> Callable:
+    """包装call, 在当前请求的_PhaseTimer上记录开始与结束的时间, 保持call是否为协程函数"""
+    if is_coroutine_callable(call):
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            timer = _phase_timer.get()
+            if timer is not None:
+                setattr(timer, start, time.perf_counter())
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                if timer is not None:
+                    setattr(timer, end, time.perf_counter())
+    else:
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            timer = _phase_timer.get()
+            if timer is not None:
+                setattr(timer, start, time.perf_counter())
+            try:
+                return call(*args, **kwargs)
+            finally:
+                if timer is not None:
+                    setattr(timer, end, time.perf_counter())
+
+    setattr(timed, "__signature__", inspect.signature(call))
+    return timed
+
+
+def _timed_app(app: ASGIApp, metrics: CBVMetrics, label: str) -> ASGIApp:
+    async def timed_app(scope: Scope, receive: Receive, send: Send) -> None:
+        timer = _PhaseTimer(time.perf_counter())
+        token = _phase_timer.set(timer)
+        try:
+            await app(scope, receive, send)
+        finally:
+            end = time.perf_counter()
+            _phase_timer.reset(token)
+            first = timer.init_start or timer.method_start
+            if first is not None:
+                metrics.observe(label, "dependencies", first - timer.start)
+            if timer.init_end is not None:
+                metrics.observe(label, "init", timer.init_end - timer.init_start)
+            if timer.method_end is not None:
+                metrics.observe(label, "method", timer.method_end - timer.method_start)
+            metrics.observe(label, "total", end - timer.start)
+
+    return timed_app
+
+
+class CBVDispatcher:
+    """
+    CBVDispatchRoute的ASGI应用, 通过HTTP方法到处理函数的字典分发请求
+    处理函数在第一次请求时确定: 优先复用include_router时app创建的同路径APIRoute,
+    找不到时(例如直接把CBVRouter当作应用使用)再由CBVRouter中的路由信息编译
+    (CBVRouter中的路由在endpoint的签名被修改之前创建, 不能直接使用)
+    """
+
+    def __init__(self, routes: Dict[str, routing.BaseRoute]):
+        self.routes = routes
+        # id(router) -> (router, [(路径的正则, 方法表)]), Router不可哈希
+        # 同一个CBVRouter可以被include多次(不同的prefix, dependencies等), 每个分发路由各有一张方法表
+        self.tables: Dict[int, Any] = {}
+
+    def _get_table(self, app_routes: List[Any], path_format: Optional[str]) -> Dict[str, ASGIApp]:
+        endpoints = {route.endpoint: method for method, route in self.routes.items()}
+        table: Dict[str, ASGIApp] = {}
+        own_routes = set(map(id, self.routes.values()))
+        for route in app_routes:
+            method = endpoints.get(getattr(route, "endpoint", None))
+            if method and id(route) not in own_routes \
+                    and isinstance(route, APIRoute) and route.path_format == path_format:
+                table.setdefault(method, route.app)
+        for method, route in self.routes.items():
+            if method not in table:
+                table[method] = _compile_route(route).app
+        if "GET" in table:
+            table.setdefault("HEAD", table["GET"])
+        return table
+
+    def _resolve(self, router: Any) -> List[Tuple[Any, Dict[str, ASGIApp]]]:
+        app_routes = getattr(router, "routes", [])
+        entries = [
+            (route.path_regex, self._get_table(app_routes, route.path_format))
+            for route in app_routes if getattr(route, "endpoint", None) is self
+        ] or [(None, self._get_table(app_routes, None))]
+        self.tables[id(router)] = (router, entries)
+        return entries
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        router = scope.get("router")
+        entry = self.tables.get(id(router))
+        entries = entry[1] if entry and entry[0] is router else self._resolve(router)
+        table = entries[0][1]
+        if len(entries) > 1:
+            # 与路由匹配的顺序相同, 第一个匹配路径的分发路由就是被匹配到的那个
+            path = scope["path"]
+            table = next((t for regex, t in entries if regex.match(path)), table)
+        app = table.get(scope["method"])
+        if app is None:
+            # 按最终的方法表生成(包括由GET处理的HEAD)
+            headers = {"Allow": ", ".join(sorted(table))}
+            if "app" in scope:
+                raise HTTPException(status_code=405, headers=headers)
+            response = PlainTextResponse("Method Not Allowed", status_code=405, headers=headers)
+            await response(scope, receive, send)
+            return
+        await app(scope, receive, send)
+
+
+class CBVDispatchRoute(Route):
+    """
+    一个CBV类的所有方法共用的路由, 路径只匹配一次, 再按HTTP方法查表分发, 不支持的方法返回405及Allow头
+    被include_router时会变为以CBVDispatcher为endpoint的普通Route, 依然有效
+    各方法原本的路由仍保留在它之后, 用于生成文档和url_for, 但不会再被匹配到
+    """
+
+    def __init__(self, path: str, routes: Dict[str, routing.BaseRoute], *, name: Optional[str] = None) -> None:
+        super().__init__(path, CBVDispatcher(routes), name=name, include_in_schema=False)
+
+
+def _compile_route(route: Any, path: Optional[str] = None) -> APIRoute:
+    """由TempRoute等只保存了信息的路由创建真正的CBVRoute"""
+    return CBVRoute(
+        path or route.path,
+        route.endpoint,
+        response_model=route.response_model,
+        status_code=route.status_code,
+        tags=route.tags,
+        dependencies=route.dependencies,
+        summary=route.summary,
+        description=route.description,
+        response_description=route.response_description,
+        responses=route.responses,
+        deprecated=route.deprecated,
+        methods=route.methods,
+        operation_id=route.operation_id,
+        response_model_include=route.response_model_include,
+        response_model_exclude=route.response_model_exclude,
+        response_model_by_alias=route.response_model_by_alias,
+        response_model_exclude_unset=route.response_model_exclude_unset,
+        response_model_exclude_defaults=route.response_model_exclude_defaults,
+        response_model_exclude_none=route.response_model_exclude_none,
+        include_in_schema=route.include_in_schema,
+        response_class=route.response_class,
+        name=route.name,
+        dependency_overrides_provider=route.dependency_overrides_provider,
+        callbacks=route.callbacks,
+    )
+
+
+def API(
+        router: CBVRouter,
+        *,
+        path: str = "",
+        group_name: Optional[str] = None,
+        scope: str = "request",
+        pool_size: int = 8,
+        compile_init: bool = False,
+        slots: bool = False,
+        concurrent: bool = False,
+        dispatch: bool = False,
+        batch: bool = False,
+        batch_limit: int = 8,
+        executor: Optional[Union[str, CBVExecutor]] = None,
+):
     """
     例:
     router = CBVRouter(path="/user", group_name="User")
@@ -155,15 +964,227 @@ def API(router: CBVRouter):
     2, 使用@API(router)包装一个类
     3, 使用@router.method()来包装与HTTP方法同名的实例方法
 
+    一个CBVRouter可以注册多个类, 此时通过path区分各个类:
+    router = CBVRouter(path="/api", group_name="API")
+
+    @API(router, path="/user", group_name="User")
+    class User: ...
+
+    @API(router, path="/item", group_name="Item")
+    class Item: ...
+
+    启动时创建一次, 关闭时释放的共享资源(连接池, 客户端等)使用cbv_resource.Resource声明:
+    class Item:
+        pool: Pool = Resource(create_pool)
+
+    子类可以再次使用@API注册, 继承父类的类依赖和路由方法, 各个类的路由互不影响:
+    @API(router, path="/admin")
+    class Admin(User):
+        role: str = Depends(get_role)
+
+        def get(self): ...  # 重写时不使用router.method()则沿用父类的配置
+
+    :param path: 拼接在router.path之后, 作为该类的路径
+    :param group_name: 该类的方法们的名字, 默认值是router的group_name
+    :param scope: 实例的作用域
+        "request": 默认值, 每个请求实例化一次, 并重新解析类依赖
+        "app": 启动时实例化一次, 所有请求共用同一个实例
+        "pooled": 启动时预先实例化pool_size个实例, 每个请求借出一个, 请求结束后归还
+        后两者的类依赖在启动时解析, 因此不能依赖请求中的参数(query, header, body等)
+        实例按app分别创建, 类依赖使用该app的dependency_overrides
+        且实例会被多个请求复用, 请不要在方法中保存请求相关的状态("app"下还会被并发访问)
+    :param pool_size: scope="pooled"时池中实例的数量
+    :param compile_init: 为类生成专用的__init__, 依赖的赋值被展开为直接的属性赋值, 省去每次请求时的循环
+    :param slots: 以类依赖的名字为类生成__slots__, 减少实例的内存占用
+        会返回一个重新创建的类, 若类中自行声明了__slots__, 则不再保留实例的__dict__
+    :param concurrent: 将互不依赖的类依赖分组, 各组并发解析, 仅对scope="request"生效
+        依赖树中含有body参数或Security的类依赖仍按原本的方式解析
+    :param dispatch: 为类创建一个CBVDispatchRoute, 路径只匹配一次, 再按HTTP方法查表分发
+    :param batch: 注册POST <path>/_batch, 请求体为[{"method": "get", "params": {...}, "body": ...}, ...]
+        类依赖只按批量请求本身解析一次, 各操作共用同一个实例并发执行(最多batch_limit个)
+        params包含路径参数和查询参数, 缺少的路径参数取自批量请求的路径
+        返回[{"status": 状态码, "body": 响应内容}, ...], 顺序与请求相同; 流式响应不支持批量调用
+    :param batch_limit: 批量请求中同时执行的操作数
+    :param executor: 该类的同步方法与同步依赖使用的CBVExecutor(kind="thread")或其名字, 优先于CBVRouter的executor
     """
+    assert scope in ("request", "app", "pooled"), "scope只能是'request', 'app', 'pooled'中的一个"
+    assert pool_size > 0, "pool_size必须大于0"
+    assert batch_limit > 0, "batch_limit必须大于0"
+    executor = _get_thread_executor(executor)
 
     def decorator(cls: Type):
-        _get_method(cls, router)
-        return cls
+        return _get_method(
+            cls, router, router.path + path, group_name or router.name,
+            scope, pool_size, compile_init, slots, concurrent, dispatch, batch, batch_limit, executor
+        )
 
     return decorator
 
 
+class BatchOperation(BaseModel):
+    method: str
+    params: Dict[str, Any] = {}
+    body: Any = None
+
+
+class BatchResult(BaseModel):
+    status: int
+    body: Any = None
+
+
+_BATCH_INSTANCE_KEY = "cbv.batch_instance"
+
+
+async def _run_background(task: Callable) -> None:
+    await task()
+
+
+def _batch_instance(request: Request) -> Any:
+    """批量请求中各操作的self, 即批量请求本身解析出的实例"""
+    return request.scope[_BATCH_INSTANCE_KEY]
+
+
+def _get_batch_endpoint(
+        routes: List[routing.BaseRoute], concurrency: int, default_provider: Optional[Any]
+) -> Callable:
+    """
+    生成批量接口的endpoint
+    各方法的路由在第一次请求时按app(dependency_overrides_provider)编译, self被替换为_batch_instance
+    """
+    compiled: Dict[int, Any] = {}
+
+    def compile_routes(provider: Any) -> Dict[str, APIRoute]:
+        table: Dict[str, APIRoute] = {}
+        for route in routes:
+            endpoint = route.endpoint
+            sub_endpoint = _copy_function(endpoint, endpoint.__qualname__)
+            signature = inspect.signature(endpoint)
+            parameters = list(signature.parameters.values())
+            setattr(sub_endpoint, "__signature__", signature.replace(
+                parameters=[parameters[0].replace(default=Depends(_batch_instance))] + parameters[1:]
+            ))
+            sub_route = copy(route)
+            sub_route.endpoint = sub_endpoint
+            sub_route.dependency_overrides_provider = provider
+            sub_route = _compile_route(sub_route)
+            for method in sub_route.methods:
+                table[method] = sub_route
+        compiled[id(provider)] = (provider, table)
+        return table
+
+    async def run(
+            request: Request, instance: Any, table: Dict[str, APIRoute], operation: BatchOperation,
+            limit: asyncio.Semaphore, background: BackgroundTasks
+    ) -> bytes:
+        route = table.get(operation.method.upper())
+        if route is None:
+            return b'{"status":405,"body":{"detail":"Method Not Allowed"}}'
+
+        path_params = dict(request.path_params)
+        query = []
+        for name, value in operation.params.items():
+            convertor = route.param_convertors.get(name)
+            if convertor is None:
+                query.extend((name, x) for x in (value if isinstance(value, list) else [value]))
+                continue
+            try:
+                path_params[name] = convertor.convert(str(value))
+            except ValueError:
+                return b'{"status":404,"body":{"detail":"Not Found"}}'
+        body = b"" if operation.body is None else json.dumps(operation.body).encode("utf-8")
+        headers = [(k, v) for k, v in request.scope["headers"] if k not in (b"content-length", b"content-type")]
+        headers.append((b"content-type", b"application/json"))
+        scope = dict(
+            request.scope,
+            method=operation.method.upper(),
+            path_params=path_params,
+            query_string=urlencode(query, doseq=True).encode("latin-1"),
+            headers=headers,
+        )
+        scope[_BATCH_INSTANCE_KEY] = instance
+
+        async def receive() -> Message:
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async with limit:
+            try:
+                response = await route.handler(Request(scope, receive))
+            except HTTPException as exc:
+                status_code, content = exc.status_code, json.dumps({"detail": exc.detail}).encode("utf-8")
+            except RequestValidationError as exc:
+                status_code, content = 422, json.dumps({"detail": jsonable_encoder(exc.errors())}).encode("utf-8")
+            except Exception:
+                # 与其他操作无关, 只让这一项失败, 不中断整个批量请求
+                logger.exception("batch operation %s %s failed", operation.method.upper(), request.url.path)
+                return b'{"status":500,"body":{"detail":"Internal Server Error"}}'
+            else:
+                status_code, content = response.status_code, getattr(response, "body", None)
+                if content is None:
+                    return b'{"status":501,"body":{"detail":"Streaming responses are not supported in batch"}}'
+                if response.background is not None:
+                    background.add_task(_run_background, response.background)
+                media_type = response.media_type or ""
+                if not media_type.endswith("json"):
+                    content = json.dumps(content.decode(response.charset)).encode("utf-8")
+                elif not content:
+                    content = b"null"
+        return b'{"status":%d,"body":%s}' % (status_code, content)
+
+    async def batch(self, request: Request, operations: List[BatchOperation] = Body(...)) -> Response:
+        provider = request.scope.get("app", default_provider)
+        entry = compiled.get(id(provider))
+        table = entry[1] if entry and entry[0] is provider else compile_routes(provider)
+        limit = asyncio.Semaphore(concurrency)
+        background = BackgroundTasks()
+        parts = await asyncio.gather(*(
+            run(request, self, table, operation, limit, background) for operation in operations
+        ))
+        return Response(b"[" + b",".join(parts) + b"]", media_type=JSONResponse.media_type, background=background)
+
+    return batch
+
+
+class WebSocketClose(Exception):
+    """在WebSocketBase的方法中抛出, 以code关闭连接, on_disconnect会收到该关闭码"""
+
+    def __init__(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        super().__init__(code)
+        self.code = code
+
+
+class _SendQueue:
+    """
+    有界的发送队列, send只入队, 由run()所在的写task依次发送
+    Hub中注册的是它而不是websocket, 所以广播也不会等待慢客户端
+    """
+
+    __slots__ = ("owner", "queue", "overflow")
+
+    def __init__(self, owner: "WebSocketBase", size: int, overflow: str):
+        self.owner = owner
+        self.queue: asyncio.Queue = asyncio.Queue(size)
+        self.overflow = overflow
+
+    async def send(self, message: Message) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.overflow == "close":
+                self.owner.abort(status.WS_1013_TRY_AGAIN_LATER)
+                return
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+
+    async def run(self) -> None:
+        websocket = self.owner.websocket
+        try:
+            while True:
+                message = await self.queue.get()
+                await websocket.send(message)
+        except Exception:
+            self.owner.abort(status.WS_1011_INTERNAL_ERROR)
+
+
 class WebSocketBase:
     """
     例:
@@ -175,13 +1196,48 @@ class WebSocketBase:
 
     1, 继承于WebSocketBase类
     2, 同时在继承括号内部写入path与router两个参数, router为默认的APIRouter即可
+       可选参数metrics=CBVMetrics(), 记录每条消息的解码(decode)与处理(on_receive)耗时
+       可选参数max_inflight=N, 开启并发处理: 持续读取消息, 同时最多有N个on_receive在运行,
+           达到上限时暂停读取, 由socket的缓冲区向客户端施加背压
+           on_receive的返回值不为None时, 会通过send()发送给客户端
+       可选参数ordered=True, 并发处理时按消息到达的顺序发送on_receive的返回值, False则按完成的顺序
+       可选参数hub=Hub(), 连接的注册表, 默认每个子类各自创建一个
+           on_connect接受连接后自动加入, 断开后自动离开所有房间
+           通过self.join(room), self.leave(room), self.broadcast(data, room)使用房间与广播
+       可选参数codec="json", 消息的编解码器, 可以是Codec实例或名字(text, bytes, json, msgpack),
+           不写时使用encoding属性; json在安装了orjson时使用orjson, 二进制帧直接交给Codec, 不做额外的复制
+       可选参数message_model=Model, 用其校验解码后的消息, on_receive收到的是校验后的值
+           校验器在定义类时创建一次; 校验失败时调用on_invalid_message, 默认以1008关闭连接
+           无法解码的消息以1003关闭连接
+       可选参数max_message_size=N, 收到超过N字节的消息时以1009关闭连接
+           (协议层的限制请使用服务器的配置, 例如uvicorn的ws_max_size)
+       可选参数send_queue_size=N, send与broadcast只把消息放进长度为N的队列, 由单独的写task发送,
+           慢客户端不会阻塞on_receive与广播; 队列满时按send_overflow处理:
+           "drop_oldest"(默认)丢弃最早的消息, "close"以1013关闭连接
+       可选参数idle_timeout=秒, 超过该时间没有收到消息时以1001关闭连接
+       可选参数ping_interval=秒, 定时调用ping()发送应用层的心跳(ASGI没有协议层ping, 由服务器负责),
+           与idle_timeout一起使用时, 客户端需要回复心跳
     3, 重写on_connect, on_receive, on_disconnect等方法
+       需要以指定的关闭码关闭连接时, 抛出WebSocketClose(code), 在其他task中则调用abort(code),
+       on_disconnect会收到该关闭码
     4, 重写__init__时请记得调用super
-    5, 请不要随意重写_decode, decode, endpoint, __init_subclass__等内容
+    5, 请不要随意重写decode, endpoint, __init_subclass__等内容
     """
 
     encoding = None
-    _decode = WebSocketEndpoint.decode
+    message_model: ClassVar[Optional[Type[Any]]] = None
+    _codec: ClassVar[Codec] = get_codec(None)
+    _message_field: ClassVar[Optional[ModelField]] = None
+    _metrics: ClassVar[Optional[CBVMetrics]] = None
+    _metrics_route: ClassVar[str] = ""
+    _max_inflight: ClassVar[Optional[int]] = None
+    _ordered: ClassVar[bool] = True
+    _max_message_size: ClassVar[Optional[int]] = None
+    _send_queue_size: ClassVar[Optional[int]] = None
+    _send_overflow: ClassVar[str] = "drop_oldest"
+    _idle_timeout: ClassVar[Optional[float]] = None
+    _ping_interval: ClassVar[Optional[float]] = None
+    hub: ClassVar[Hub]
 
     def __init__(self, websocket: WebSocket):
         self.websocket = websocket
@@ -193,36 +1249,256 @@ class WebSocketBase:
         assert isinstance(router, APIRouter), "缺少参数 router"
         assert isinstance(path, str), "缺少参数 path"
         assert endpoint, "缺少方法 endpoint"
+        cls._metrics = kwargs.get("metrics", None)
+        cls._metrics_route = f"WEBSOCKET {path}"
+        cls._max_inflight = kwargs.get("max_inflight", None)
+        cls._ordered = kwargs.get("ordered", True)
+        cls.hub = kwargs.get("hub", None) or Hub()
+        codec = kwargs.get("codec", None)
+        cls._codec = get_codec(cls.encoding if codec is None else codec)
+        cls.message_model = kwargs.get("message_model", cls.message_model)
+        if cls.message_model is not None:
+            cls._message_field = create_response_field(name="message", type_=cls.message_model)
+        cls._max_message_size = kwargs.get("max_message_size", None)
+        cls._send_queue_size = kwargs.get("send_queue_size", None)
+        cls._send_overflow = kwargs.get("send_overflow", "drop_oldest")
+        cls._idle_timeout = kwargs.get("idle_timeout", None)
+        cls._ping_interval = kwargs.get("ping_interval", None)
+        assert cls._max_inflight is None or cls._max_inflight > 0, "max_inflight必须大于0"
+        assert cls._send_queue_size is None or cls._send_queue_size > 0, "send_queue_size必须大于0"
+        assert cls._send_overflow in ("drop_oldest", "close"), "send_overflow只能是drop_oldest或close"
 
         _update_cbv_class_init(cls)
-        ws_cls = APIWebSocketRoute(path, endpoint)
+        # 子类通常共用WebSocketBase.endpoint, 复制一份, 否则各子类设置的__signature__会互相覆盖
+        endpoint = _copy_function(endpoint, f"{cls.__qualname__}.endpoint")
+        # TempRouter只保存路由信息, 依赖分析在被include_router时进行一次
+        if isinstance(router, TempRouter):
+            ws_cls = TempWebSocketRoute(path, endpoint)
+            ws_cls.__class__ = APIWebSocketRoute
+        else:
+            ws_cls = APIWebSocketRoute(path, endpoint)
         _update_endpoint_self_param(cls, ws_cls)
         router.routes.append(ws_cls)
+        register_resources(cls, router)
 
     async def endpoint(self) -> None:
         assert self.websocket, "请在__init__()中配置正确的websocket对象"
+        self._task = asyncio.current_task()
+        self._abort_code: Optional[int] = None
+        self._background: List[asyncio.Future] = []
+        if self._send_queue_size is None:
+            self._outlet = self.websocket
+        else:
+            self._outlet = _SendQueue(self, self._send_queue_size, self._send_overflow)
         await self.on_connect()
         # ------------------------------
         close_code = status.WS_1000_NORMAL_CLOSURE
         try:
-            while True:
-                message = await self.websocket.receive()
-                if message["type"] == "websocket.receive":
-                    data = await self.decode(message)
-                    await self.on_receive(data)
-                    # ------------------------------
-                elif message["type"] == "websocket.disconnect":
-                    close_code = int(message.get("code", status.WS_1000_NORMAL_CLOSURE))
-                    break
+            if self.websocket.application_state == WebSocketState.CONNECTED:
+                self._start_background()
+                await self.hub.join(self._outlet)
+            if self._max_inflight is None:
+                close_code = await self._receive_sequentially()
+            else:
+                close_code = await self._receive_concurrently()
+        except WebSocketClose as exc:
+            close_code = await self._close(exc.code)
+        except asyncio.CancelledError:
+            if self._abort_code is None:
+                raise
+            # abort()取消了本task, 撤销这次取消, 以免影响之后的await
+            uncancel = getattr(self._task, "uncancel", None)
+            if uncancel is not None:
+                uncancel()
+            close_code = await self._close(self._abort_code)
         except Exception as exc:
             close_code = status.WS_1011_INTERNAL_ERROR
             raise exc from None
         finally:
+            if self._abort_code is None:
+                self._abort_code = close_code
+            self._stop_background()
+            await self.hub.leave(self._outlet)
             await self.on_disconnect(close_code)
             # ------------------------------
 
+    def abort(self, code: int = status.WS_1011_INTERNAL_ERROR) -> None:
+        """从其他task(写task, 心跳, 广播)中以code关闭连接, 第一次调用生效"""
+        if self._abort_code is None and not self._task.done():
+            self._abort_code = code
+            self._task.cancel()
+
+    async def _close(self, code: int) -> int:
+        self._stop_background()
+        if self.websocket.application_state == WebSocketState.CONNECTED:
+            await self.websocket.close(code=code)
+        return code
+
+    def _start_background(self) -> None:
+        if isinstance(self._outlet, _SendQueue):
+            self._background.append(asyncio.ensure_future(self._outlet.run()))
+        if self._ping_interval is not None:
+            self._background.append(asyncio.ensure_future(self._keepalive()))
+
+    def _stop_background(self) -> None:
+        for task in self._background:
+            task.cancel()
+        self._background.clear()
+
+    async def _keepalive(self) -> None:
+        try:
+            while True:
+                await asyncio.sleep(self._ping_interval)
+                await self.ping()
+        except Exception:
+            self.abort(status.WS_1011_INTERNAL_ERROR)
+
+    async def ping(self) -> None:
+        """应用层心跳, 默认发送文本"ping", 可以重写"""
+        await self._outlet.send({"type": "websocket.send", "text": "ping"})
+
+    async def _receive(self) -> Message:
+        """接收一条消息, 检查idle_timeout与max_message_size"""
+        if self._idle_timeout is None:
+            message = await self.websocket.receive()
+        else:
+            try:
+                message = await asyncio.wait_for(self.websocket.receive(), self._idle_timeout)
+            except asyncio.TimeoutError:
+                raise WebSocketClose(status.WS_1001_GOING_AWAY) from None
+        limit = self._max_message_size
+        if limit is not None and message["type"] == "websocket.receive":
+            data = message.get("bytes")
+            if data is not None:
+                size = len(data)
+            else:
+                text = message.get("text") or ""
+                # utf-8最多4字节一个字符, 大多数消息不需要真的编码
+                size = len(text) if len(text) * 4 <= limit else len(text.encode("utf-8"))
+            if size > limit:
+                raise WebSocketClose(status.WS_1009_MESSAGE_TOO_BIG)
+        return message
+
+    async def _receive_sequentially(self) -> int:
+        """逐条接收并处理消息, 返回关闭码"""
+        metrics = self._metrics
+        while True:
+            message = await self._receive()
+            if message["type"] == "websocket.receive":
+                if metrics is None:
+                    data = await self.decode(message)
+                    await self.on_receive(data)
+                else:
+                    await self._timed_receive(metrics, message)
+                # ------------------------------
+            elif message["type"] == "websocket.disconnect":
+                return int(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+
+    async def _receive_concurrently(self) -> int:
+        """
+        持续接收消息, 每条消息的on_receive在单独的task中运行, 同时最多max_inflight个
+        某个task出错时取消读取, 并在此处抛出该异常; 断开连接时取消仍在运行的task
+        """
+        limit = asyncio.Semaphore(self._max_inflight)
+        reader = asyncio.current_task()
+        tasks: Set[asyncio.Future] = set()
+        failures: List[BaseException] = []
+        previous: Optional[asyncio.Future] = None
+
+        def done(task: asyncio.Future) -> None:
+            tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None and not failures:
+                failures.append(task.exception())
+                reader.cancel()
+
+        try:
+            while True:
+                await limit.acquire()
+                message = await self._receive()
+                if message["type"] == "websocket.receive":
+                    start = time.perf_counter()
+                    data = await self.decode(message)
+                    if self._metrics is not None:
+                        self._metrics.observe(self._metrics_route, "decode", time.perf_counter() - start)
+                    task = asyncio.ensure_future(self._handle_concurrently(data, limit, previous))
+                    task.add_done_callback(done)
+                    tasks.add(task)
+                    if self._ordered:
+                        previous = task
+                    # ------------------------------
+                elif message["type"] == "websocket.disconnect":
+                    return int(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+                else:
+                    limit.release()
+        except asyncio.CancelledError:
+            if failures:
+                raise failures[0] from None
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _handle_concurrently(
+            self, data: Any, limit: asyncio.Semaphore, previous: Optional[asyncio.Future]
+    ) -> None:
+        """
+        运行on_receive并发送返回值, 有序时等待上一条消息发送完毕后再发送
+        发送之后才释放名额, 避免有序模式下积压过多已完成的结果
+        """
+        try:
+            start = time.perf_counter()
+            result = await self.on_receive(data)
+            if self._metrics is not None:
+                self._metrics.observe(self._metrics_route, "on_receive", time.perf_counter() - start)
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            if result is not None:
+                await self.send(result)
+        finally:
+            limit.release()
+
+    async def _timed_receive(self, metrics: CBVMetrics, message: Message) -> None:
+        start = time.perf_counter()
+        data = await self.decode(message)
+        decoded = time.perf_counter()
+        await self.on_receive(data)
+        metrics.observe(self._metrics_route, "decode", decoded - start)
+        metrics.observe(self._metrics_route, "on_receive", time.perf_counter() - decoded)
+
     async def decode(self, message: Message) -> typing.Any:
-        return await self._decode(message=message, websocket=self.websocket)
+        try:
+            data = self._codec.decode(message)
+        except CodecError:
+            raise WebSocketClose(status.WS_1003_UNSUPPORTED_DATA) from None
+        field = self._message_field
+        if field is not None:
+            value, errors = field.validate(data, {}, loc=("message",))
+            if errors:
+                return await self.on_invalid_message(data, WebSocketRequestValidationError([errors]))
+            return value
+        return data
+
+    async def on_invalid_message(self, data: Any, exc: WebSocketRequestValidationError) -> Any:
+        """消息没有通过message_model的校验, 返回值会代替消息交给on_receive"""
+        raise WebSocketClose(status.WS_1008_POLICY_VIOLATION)
+
+    async def send(self, data: Any) -> None:
+        """
+        用codec编码并发送数据
+        encoding为None时按类型判断: str为文本, bytes为二进制, 其他为json
+        """
+        await self._outlet.send(self._codec.encode(data))
+
+    async def join(self, room: str) -> None:
+        await self.hub.join(self._outlet, room)
+
+    async def leave(self, room: str) -> None:
+        await self.hub.leave(self._outlet, room)
+
+    async def broadcast(self, data: Any, room: str = ALL, *, include_self: bool = True) -> int:
+        """用codec编码一次, 并发地发送给房间内的所有连接, 返回发送成功的数量"""
+        exclude = () if include_self else (self._outlet,)
+        return await self.hub.broadcast(data, room, encoding=self._codec, exclude=exclude)
 
     async def on_connect(self) -> None:
         """Override to handle an incoming websocket connection"""
@@ -235,34 +1511,284 @@ class WebSocketBase:
         """Override to handle a disconnecting websocket"""
 
 
-def _get_method(cls, router):
+class _InstanceProvider:
+    """
+    scope为"app"或"pooled"时的实例提供者
+    实例按app(dependency_overrides_provider)各自创建, 类依赖使用该app的dependency_overrides
+    被include到app中的路由会记录app, 在router的on_startup中为它们创建实例, 类依赖中的yield依赖在on_shutdown时关闭
+    若启动事件没有触发(例如直接调用app), 则在第一次请求时创建
+    """
+
+    def __init__(self, cls: Type[Any], router: CBVRouter, path: str, scope: str, pool_size: int):
+        self.cls = cls
+        self.router = router
+        self.path = path
+        self.size = pool_size if scope == "pooled" else 1
+        # id(app) -> app, 由CBVRoute在被include时记录, app不可哈希
+        self.apps: Dict[int, Any] = {}
+        # id(app) -> (app, 实例, 实例池)
+        self.states: Dict[int, Tuple[Any, List[Any], asyncio.Queue]] = {}
+        self.stack: Optional[AsyncExitStack] = None
+        self.lock: Optional[asyncio.Lock] = None
+
+    def bind(self, app: Any) -> None:
+        if app is not None:
+            self.apps.setdefault(id(app), app)
+
+    async def _build(self, app: Any) -> Any:
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": self.path,
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+            "path_params": {},
+            "fastapi_astack": self.stack,
+        }
+        if app is not None:
+            scope["app"] = app
+        dependant = get_dependant(path=self.path, call=self.cls)
+        values, errors, *_ = await solve_dependencies(
+            request=Request(scope),
+            dependant=dependant,
+            dependency_overrides_provider=app,
+        )
+        assert not errors, f"{self.cls.__name__}的类依赖无法在启动时解析, 请使用scope='request'"
+        return self.cls(**values)
+
+    async def _get_state(self, app: Any) -> Tuple[Any, List[Any], asyncio.Queue]:
+        state = self.states.get(id(app))
+        if state is not None and state[0] is app:
+            return state
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            state = self.states.get(id(app))
+            if state is not None and state[0] is app:
+                return state
+            if self.stack is None:
+                self.stack = AsyncExitStack()
+            instances = [await self._build(app) for _ in range(self.size)]
+            pool: asyncio.Queue = asyncio.Queue()
+            for instance in instances:
+                pool.put_nowait(instance)
+            state = self.states[id(app)] = (app, instances, pool)
+            return state
+
+    def _get_app(self, request: Request) -> Any:
+        """与路由相同: include到FastAPI时为app, 直接使用CBVRouter时为router的dependency_overrides_provider"""
+        app = request.scope.get("app")
+        if getattr(app, "dependency_overrides", None) is None:
+            return self.router.dependency_overrides_provider
+        return app
+
+    async def startup(self) -> None:
+        for app in list(self.apps.values()) or [self.router.dependency_overrides_provider]:
+            await self._get_state(app)
+
+    async def shutdown(self) -> None:
+        if self.stack is not None:
+            await self.stack.aclose()
+        self.states = {}
+        self.stack = None
+
+    async def app_instance(self, request: Request) -> Any:
+        return (await self._get_state(self._get_app(request)))[1][0]
+
+    async def pooled_instance(self, request: Request) -> AsyncIterator[Any]:
+        pool = (await self._get_state(self._get_app(request)))[2]
+        instance = await pool.get()
+        try:
+            yield instance
+        finally:
+            pool.put_nowait(instance)
+
+
+def _get_instance_provider(cls: Type[Any], router: CBVRouter, path: str, scope: str, pool_size: int) -> Callable:
+    """
+    根据scope返回endpoint中self参数所依赖的对象
+    """
+    if scope == "request":
+        return cls
+
+    provider = _InstanceProvider(cls, router, path, scope, pool_size)
+    router.on_startup.append(provider.startup)
+    router.on_shutdown.append(provider.shutdown)
+    if scope == "app":
+        return provider.app_instance
+    return provider.pooled_instance
+
+
+def _get_method(
+        cls, router, path, group_name, scope="request", pool_size=8,
+        compile_init=False, slots=False, concurrent=False, dispatch=False, batch=False, batch_limit=8,
+        executor=None
+):
     """抽离的公共代码"""
     # ------------修改__init__签名------------
-    _update_cbv_class_init(cls)
+    _update_cbv_class_init(cls, compile_init)
+    if slots:
+        cls = _build_slots_class(cls)
+
+    def register():
+        _add_class_routes(
+            cls, router, path, group_name, scope, pool_size, concurrent, dispatch, batch, batch_limit, executor
+        )
+
+    if router.lazy:
+        router.pending.append(register)
+    else:
+        register()
+    return cls
+
+
+def _add_class_routes(
+        cls, router, path, group_name, scope, pool_size, concurrent, dispatch, batch=False, batch_limit=8,
+        executor=None
+):
+    """为类创建路由, 并修改各个endpoint的self参数"""
+    # 先于scope="app"/"pooled"的实例创建, 以便__init__中可以使用Resource
+    register_resources(cls, router)
+    provider = _get_instance_provider(cls, router, path, scope, pool_size)
+    # scope为"app"/"pooled"时的_InstanceProvider, 记录在各路由的配置上
+    instances = None if scope == "request" else getattr(provider, "__self__")
+    if scope == "request" and concurrent:
+        provider = _get_concurrent_factory(provider, path)
 
     # ----------------抓取方法----------------
-    function_members = inspect.getmembers(cls, inspect.isfunction)
-    functions_set = set(func for _, func in function_members)
+    # 继承的方法来自父类已缓存的分析结果, 只有类自身的成员需要遍历
+    for name, (member, options) in _get_routed_methods(cls).items():
+        endpoint = _get_class_endpoint(cls, name, member, options)
+        route = router.add_cbv_route(cls, endpoint, path, group_name, executor)
+        uses = options["uses"]
+        if scope == "request" and uses is not None:
+            factory = _get_pruned_factory(cls, member, uses)
+            if concurrent:
+                factory = _get_concurrent_factory(factory, path)
+            _update_endpoint_self_param(cls, route, factory)
+        else:
+            _update_endpoint_self_param(cls, route, provider)
+            if instances is not None:
+                getattr(route.endpoint, CBV_OPTIONS_KEY)["instances"] = instances
+
+    if dispatch and router.classes.get(cls):
+        routes = router.classes[cls]
+        dispatch_route = CBVDispatchRoute(
+            path, {method: route for route in routes for method in route.methods}, name=group_name
+        )
+        router.routes.insert(router.routes.index(routes[0]), dispatch_route)
+
+    if batch and router.classes.get(cls):
+        routes = router.classes[cls]
+        batch_route = router.route_class(
+            path + "/_batch",
+            endpoint=_get_batch_endpoint(routes, batch_limit, router.dependency_overrides_provider),
+            methods=["POST"],
+            response_model=List[BatchResult],
+            response_class=router.default_response_class,
+            tags=router.tags,
+            summary=f"{group_name} _ batch",
+            operation_id=f"{group_name}_{path[1:]}_batch",
+            dependency_overrides_provider=router.dependency_overrides_provider,
+        )
+        batch_route.__class__ = CBVRoute
+        # self的解析(类依赖与实例化)与各方法相同, 使用类的executor
+        setattr(batch_route.endpoint, CBV_OPTIONS_KEY, {
+            "router": router, "class_executor": executor or router.executor, "instances": instances
+        })
+        _update_endpoint_self_param(cls, batch_route, provider)
+        # 放在类的其他路由之前, 以免被"<path>/{param}"之类的路由匹配到
+        router.routes.insert(router.routes.index(routes[0]), batch_route)
 
-    def temp(r):
-        if isinstance(r, (Route, WebSocketRoute)) and r.endpoint in functions_set:
-            _update_endpoint_self_param(cls, r)
-            return True
-        return False
 
-    router.routes = list(filter(temp, router.routes))
+# 每个类的分析结果, 子类在父类结果的基础上只分析自己新增的成员
+_class_hints: "weakref.WeakKeyDictionary[type, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+_class_methods: "weakref.WeakKeyDictionary[type, Dict[str, Tuple[Callable, Dict[str, Any]]]]" = \
+    weakref.WeakKeyDictionary()
 
 
-def _update_cbv_class_init(cls: Type[Any]) -> None:
+def _get_class_hints(cls: type) -> Dict[str, Any]:
+    """
+    与get_type_hints(cls)相同, 但父类的结果会被缓存
+    子类只需解析自身的__annotations__, 不会为整个MRO重新求值
+    """
+    hints = _class_hints.get(cls)
+    if hints is None:
+        hints = {}
+        for base in reversed(cls.__bases__):
+            if base is not object:
+                hints.update(_get_class_hints(base))
+        own = cls.__dict__.get("__annotations__")
+        if own:
+            hints.update(resolve_annotations(own, cls.__module__))
+        _class_hints[cls] = hints
+    return hints
+
+
+def _get_routed_methods(cls: type) -> Dict[str, Tuple[Callable, Dict[str, Any]]]:
+    """
+    类的路由方法(包括继承的), 名字 -> (函数, router.method()的配置), 父类的结果会被缓存
+    子类重写父类的路由方法但没有使用router.method()时, 沿用父类的配置;
+    重写为非函数(例如get = None)时移除该路由
+    """
+    methods = _class_methods.get(cls)
+    if methods is None:
+        methods = {}
+        for base in reversed(cls.__bases__):
+            if base is not object:
+                methods.update(_get_routed_methods(base))
+        for name, member in vars(cls).items():
+            if inspect.isfunction(member) and hasattr(member, CBV_OPTIONS_KEY):
+                methods[name] = (member, getattr(member, CBV_OPTIONS_KEY))
+            elif name in methods:
+                if inspect.isfunction(member):
+                    methods[name] = (member, methods[name][1])
+                else:
+                    del methods[name]
+        _class_methods[cls] = methods
+    return methods
+
+
+def _copy_function(func: Callable, qualname: str) -> Callable:
+    """复制函数对象, 副本有自己的__dict__与__signature__, 修改它们不会影响原函数"""
+    new_func = types.FunctionType(func.__code__, func.__globals__, func.__name__, func.__defaults__, func.__closure__)
+    new_func.__dict__.update(func.__dict__)
+    new_func.__kwdefaults__ = func.__kwdefaults__
+    new_func.__annotations__ = dict(func.__annotations__)
+    new_func.__doc__ = func.__doc__
+    new_func.__module__ = func.__module__
+    new_func.__qualname__ = qualname
+    return new_func
+
+
+def _get_class_endpoint(cls: type, name: str, func: Callable, options: Dict[str, Any]) -> Callable:
+    """
+    为类生成方法的endpoint, 每个类(包括子类)各有一份, 路由配置也各自复制一份
+    继承同一方法的多个类可以注册到同一个router, 也不会互相覆盖签名中的self
+    """
+    endpoint = _copy_function(func, f"{cls.__qualname__}.{name}")
+    setattr(endpoint, CBV_OPTIONS_KEY, dict(options))
+    # 进程池需要pickle原函数(按模块与__qualname__查找), 副本无法被找到
+    setattr(endpoint, "__cbv_function__", func)
+    return endpoint
+
+
+def _update_cbv_class_init(cls: Type[Any], compile_init: bool = False) -> None:
     """
     重定义类的__init__(), 更新签名和参数
+    :param compile_init: 使用_compile_init生成的__init__代替通用的new_init
     """
     CBV_CLASS_KEY = "__cbv_class__"
 
-    if getattr(cls, CBV_CLASS_KEY, False):
+    # 只看类自身, 继承而来的标记说明父类已处理, 子类仍需要按自己的依赖重新生成__init__
+    if cls.__dict__.get(CBV_CLASS_KEY, False):
         return  # Already initialized
 
     old_init: Callable[..., Any] = cls.__init__
+    if "__init__" not in cls.__dict__ and hasattr(cls, "__cbv_old_init__"):
+        # 继承的是父类生成的__init__, 改为包装父类原本的__init__, 依赖由子类的__init__统一赋值
+        old_init = getattr(cls, "__cbv_old_init__")
     old_signature = inspect.signature(old_init)
     old_parameters = list(old_signature.parameters.values())[1:]
 
@@ -273,8 +1799,9 @@ def _update_cbv_class_init(cls: Type[Any]) -> None:
     ]
 
     dependency_names: List[str] = []
-    for name, hint in get_type_hints(cls).items():
-        if is_classvar(hint):
+    for name, hint in _get_class_hints(cls).items():
+        # Resource由router的启动/关闭事件管理, 不是类依赖
+        if is_classvar(hint) or isinstance(getattr(cls, name, None), Resource):
             continue
         parameter_kwargs = {"default": getattr(cls, name, Ellipsis)}
         dependency_names.append(name)
@@ -288,27 +1815,367 @@ def _update_cbv_class_init(cls: Type[Any]) -> None:
         )
     new_signature = old_signature.replace(parameters=new_parameters)
 
-    def new_init(self: Any, *args: Any, **kwargs: Any) -> None:
-        for dep_name in dependency_names:
-            dep_value = kwargs.pop(dep_name)
-            setattr(self, dep_name, dep_value)
-        old_init(self, *args, **kwargs)
+    make_init = _compile_init if compile_init else _make_init
+    new_init = make_init(cls, old_init, dependency_names)
 
     setattr(cls, "__signature__", new_signature)
     setattr(cls, "__init__", new_init)
+    setattr(cls, "__cbv_dependencies__", tuple(dependency_names))
+    setattr(cls, "__cbv_old_init__", old_init)
+    setattr(cls, "__cbv_make_init__", make_init)
     setattr(cls, CBV_CLASS_KEY, True)
 
 
-def _update_endpoint_self_param(cls: Type[Any], route: Union[Route, WebSocketRoute]) -> None:
+# _compile_init生成的__init__中, 未传入的依赖的默认值
+_MISSING = object()
+
+
+def _make_init(cls: Type[Any], old_init: Callable[..., Any], dependency_names: List[str]) -> Callable:
+    """
+    通用的__init__, 先将依赖赋值给实例, 再调用原本的__init__
+    kwargs中没有的依赖会被跳过: 子类的__init__中调用super().__init__()时, 父类生成的__init__会再次运行,
+    此时依赖已经由子类的__init__赋值, 只需调用父类原本的__init__
+    """
+
+    def new_init(self: Any, *args: Any, **kwargs: Any) -> None:
+        for dep_name in dependency_names:
+            if dep_name in kwargs:
+                setattr(self, dep_name, kwargs.pop(dep_name))
+        old_init(self, *args, **kwargs)
+
+    return new_init
+
+
+def _compile_init(cls: Type[Any], old_init: Callable[..., Any], dependency_names: List[str]) -> Callable:
+    """
+    生成类专用的__init__, 例如依赖为x, y时:
+
+    def __init__(__cbv_self__, *__cbv_args__, x=__cbv_missing__, y=__cbv_missing__, **__cbv_kwargs__):
+        if x is not __cbv_missing__:
+            __cbv_self__.x = x
+        if y is not __cbv_missing__:
+            __cbv_self__.y = y
+        __cbv_old_init__(__cbv_self__, *__cbv_args__, **__cbv_kwargs__)
+
+    未重写__init__时(object.__init__), 省略最后一行的调用
+    依赖可以缺省, 原因与_make_init相同(经super().__init__()再次调用时依赖已经赋值)
+    """
+    params = ["__cbv_self__", "*__cbv_args__"] + [f"{name}=__cbv_missing__" for name in dependency_names]
+    params.append("**__cbv_kwargs__")
+    lines = [f"def __init__({', '.join(params)}):"]
+    for name in dependency_names:
+        lines.append(f"    if {name} is not __cbv_missing__:")
+        lines.append(f"        __cbv_self__.{name} = {name}")
+    if old_init is not object.__init__:
+        lines.append("    __cbv_old_init__(__cbv_self__, *__cbv_args__, **__cbv_kwargs__)")
+    elif not dependency_names:
+        lines.append("    pass")
+
+    namespace = {"__cbv_old_init__": old_init, "__cbv_missing__": _MISSING}
+    exec("\n".join(lines), namespace)
+    new_init = namespace["__init__"]
+    new_init.__module__ = cls.__module__
+    new_init.__qualname__ = f"{cls.__qualname__}.__init__"
+    return new_init
+
+
+def _build_slots_class(cls: Type[Any]) -> Type[Any]:
+    """
+    以类依赖为__slots__重新创建类
+    类中的Depends默认值已经保存在__signature__中, 此处直接移除, 避免与slot冲突
+    """
+    dependency_names = getattr(cls, "__cbv_dependencies__")
+    namespace = dict(cls.__dict__)
+    own_slots = namespace.pop("__slots__", None)
+    if isinstance(own_slots, str):
+        own_slots = (own_slots,)
+
+    for name in list(own_slots or ()) + list(dependency_names) + ["__dict__", "__weakref__"]:
+        namespace.pop(name, None)
+
+    slots = list(own_slots or ())
+    for name in dependency_names:
+        inherited = getattr(cls.__base__, name, None)
+        if name not in slots and not isinstance(inherited, types.MemberDescriptorType):
+            slots.append(name)
+    if own_slots is None:
+        # 没有自行声明__slots__时, 保留__dict__以便在__init__或方法中设置其他属性
+        if all(base.__dictoffset__ == 0 for base in cls.__bases__):
+            slots.append("__dict__")
+        if all(base.__weakrefoffset__ == 0 for base in cls.__bases__):
+            slots.append("__weakref__")
+
+    namespace["__slots__"] = tuple(slots)
+    namespace["__qualname__"] = cls.__qualname__
+    new_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+
+    # 修正方法中super()所使用的__class__
+    for value in namespace.values():
+        if isinstance(value, (classmethod, staticmethod)):
+            value = value.__func__
+        elif isinstance(value, property):
+            value = value.fget
+        code = getattr(value, "__code__", None)
+        if code is not None and "__class__" in code.co_freevars:
+            cell = value.__closure__[code.co_freevars.index("__class__")]
+            if cell.cell_contents is cls:
+                cell.cell_contents = new_cls
+    return new_cls
+
+
+class _PrunedDependency:
+    """
+    代替类依赖在类上的默认值, 类本身读取时仍返回默认值(子类的分析需要它)
+    实例读取时说明该依赖被uses剪除而没有解析; 完整解析的实例在__dict__中有值, 不会经过这里
+    """
+
+    __slots__ = ("name", "default")
+
+    def __init__(self, name: str, default: Any):
+        self.name = name
+        self.default = default
+
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Any:
+        if instance is None:
+            return self.default
+        raise RuntimeError(f"类依赖{self.name}没有被解析, 请把它加入该方法router.method()的uses中")
+
+
+def _get_pruned_factory(cls: Type[Any], func: Callable, uses: Union[Sequence[str], str]) -> Callable:
+    """
+    为方法生成只包含所需类依赖的构造函数, 用于代替cls作为self的依赖
+    """
+    dependency_names = getattr(cls, "__cbv_dependencies__")
+    if uses == "auto":
+        used = _find_used_dependencies(cls, func)
+        if used is None:
+            return cls
+        uses = [name for name in dependency_names if name in used]
+    else:
+        for name in uses:
+            assert name in dependency_names, f"{cls.__name__}中没有名为{name}的类依赖"
+        uses = [name for name in dependency_names if name in uses]
+
+    if len(uses) == len(dependency_names):
+        return cls
+
+    # 被剪除的依赖不会赋值给实例, 读取时报错, 而不是读到类属性上的默认值(例如Depends对象)
+    # slots=True时是slot, 未赋值的slot本身就会报错, 不能替换
+    for name in dependency_names:
+        if name in uses or not hasattr(cls, name):
+            continue
+        member = inspect.getattr_static(cls, name)
+        if not isinstance(member, (_PrunedDependency, types.MemberDescriptorType)):
+            setattr(cls, name, _PrunedDependency(name, member))
+
+    make_init = getattr(cls, "__cbv_make_init__")
+    init = make_init(cls, getattr(cls, "__cbv_old_init__"), uses)
+    signature = getattr(cls, "__signature__")
+    signature = signature.replace(parameters=[
+        x for x in signature.parameters.values()
+        if x.name not in dependency_names or x.name in uses
+    ])
+
+    def factory(*args: Any, **kwargs: Any) -> Any:
+        instance = cls.__new__(cls)
+        init(instance, *args, **kwargs)
+        return instance
+
+    setattr(factory, "__signature__", signature)
+    return factory
+
+
+def _get_concurrent_factory(
+        build: Callable, path: str, exclude: Set[Any] = frozenset(), executor: Optional[CBVExecutor] = None
+) -> Callable:
+    """
+    将build(cls或_get_pruned_factory的结果)签名中互不依赖的类依赖分组, 返回一个并发解析各组的构造函数
+    两个类依赖的依赖树中存在相同的函数时, 它们被分在同一组, 以保证该函数只被调用一次
+    被分组的类依赖中的path, query, header, cookie参数仍保留在签名中, 以便校验和生成文档
+    分组少于两个时直接返回build
+    :param exclude: 路由中其他依赖的函数, 依赖树中含有它们的类依赖不分组(各组的依赖缓存是独立的)
+    :param executor: 分组内的同步依赖与同步的build在此运行, 默认使用Starlette的线程池
+    """
+    groups: List[List[inspect.Parameter]] = []
+    group_calls: List[set] = []
+    kept: List[inspect.Parameter] = []
+    for parameter in inspect.signature(build).parameters.values():
+        depends = parameter.default
+        if not isinstance(depends, params.Depends) or isinstance(depends, params.Security):
+            kept.append(parameter)
+            continue
+        call = depends.dependency or parameter.annotation
+        flat = get_flat_dependant(get_dependant(path=path, call=call))
+        if flat.body_params or flat.security_requirements:
+            kept.append(parameter)
+            continue
+
+        calls = _get_dependency_calls(get_dependant(path=path, call=call)) | {call}
+        if calls & exclude:
+            kept.append(parameter)
+            continue
+        merged = [i for i, x in enumerate(group_calls) if x & calls]
+        group, group_call = [parameter], calls
+        for i in reversed(merged):
+            group = groups.pop(i) + group
+            group_call = group_calls.pop(i) | group_call
+        groups.append(group)
+        group_calls.append(group_call)
+
+    if len(groups) < 2:
+        return build
+
+    dependants: List[Dependant] = []
+    hidden_parameters: Dict[tuple, inspect.Parameter] = {}
+    for group in groups:
+        def stub(): pass
+
+        setattr(stub, "__signature__", inspect.Signature(group))
+        dependant = get_dependant(path=path, call=stub)
+        dependants.append(dependant)
+        flat = get_flat_dependant(dependant)
+        for field in flat.path_params + flat.query_params + flat.header_params + flat.cookie_params:
+            key = (type(field.field_info), field.alias)
+            if key in hidden_parameters:
+                continue
+            field_info = copy(field.field_info)
+            field_info.alias = field.alias
+            hidden_parameters[key] = inspect.Parameter(
+                name=f"__cbv_param_{len(hidden_parameters)}__",
+                kind=inspect.Parameter.KEYWORD_ONLY,
+                annotation=field.outer_type_,
+                default=field_info,
+            )
+
+    if executor is not None:
+        _use_dependency_executor(dependants, executor)
+
+    special_parameters = [
+        inspect.Parameter(name=name, kind=inspect.Parameter.KEYWORD_ONLY, annotation=annotation)
+        for name, annotation in (
+            ("__cbv_request__", Request),
+            ("__cbv_response__", Response),
+            ("__cbv_background__", BackgroundTasks),
+        )
+    ]
+    is_coroutine = is_coroutine_callable(build)
+
+    async def factory(**kwargs: Any) -> Any:
+        request = kwargs.pop("__cbv_request__")
+        response = kwargs.pop("__cbv_response__")
+        background_tasks = kwargs.pop("__cbv_background__")
+        for parameter in hidden_parameters.values():
+            kwargs.pop(parameter.name)
+        provider = request.scope.get("app")
+
+        results = await asyncio.gather(*[
+            solve_dependencies(
+                request=request,
+                dependant=dependant,
+                response=response,
+                background_tasks=background_tasks,
+                dependency_overrides_provider=provider,
+            )
+            for dependant in dependants
+        ])
+        errors = []
+        for values, sub_errors, *_ in results:
+            kwargs.update(values)
+            errors.extend(sub_errors)
+        if errors:
+            raise RequestValidationError(errors)
+
+        if is_coroutine:
+            return await build(**kwargs)
+        if executor is not None:
+            return await executor.run(build, (), kwargs)
+        return await run_in_threadpool(build, **kwargs)
+
+    # CBVRoute按路由的全部依赖重新生成时使用
+    setattr(factory, "__cbv_concurrent__", (build, set().union(*group_calls)))
+    setattr(factory, "__cbv_dependants__", dependants)
+    setattr(factory, "__signature__", inspect.Signature(
+        [x.replace(kind=inspect.Parameter.KEYWORD_ONLY) for x in kept]
+        + special_parameters
+        + list(hidden_parameters.values())
+    ))
+    return factory
+
+
+def _get_dependency_calls(dependant: Dependant) -> set:
+    """依赖树中所有的函数"""
+    calls = set()
+    for sub_dependant in dependant.dependencies:
+        calls.add(sub_dependant.call)
+        calls |= _get_dependency_calls(sub_dependant)
+    return calls
+
+
+def _find_used_dependencies(cls: Type[Any], func: Callable) -> Optional[set]:
+    """
+    分析func中self.<attr>的读取, 返回用到的类依赖的名字
+    遇到self.<method>, self.<property>时继续分析对应的函数, __init__总是会被分析
+    无法确定时返回None
+    """
+    dependency_names = getattr(cls, "__cbv_dependencies__")
+    used = set()
+    pending = [func]
+    old_init = getattr(cls, "__cbv_old_init__")
+    if old_init is not object.__init__:
+        pending.append(old_init)
+    seen = set()
+
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            tree = ast.parse(textwrap.dedent(inspect.getsource(current)))
+        except (OSError, TypeError, SyntaxError):
+            return None
+        node = tree.body[0]
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or not node.args.args:
+            return None
+        if any(isinstance(x, ast.Name) and x.id in ("super", "__class__") for x in ast.walk(node)):
+            return None  # 无参数的super()不引用self, 无法得知父类方法读取了哪些依赖
+        self_name = node.args.args[0].arg
+
+        attributes = [
+            x for x in ast.walk(node)
+            if isinstance(x, ast.Attribute) and isinstance(x.value, ast.Name) and x.value.id == self_name
+        ]
+        names = [x for x in ast.walk(node) if isinstance(x, ast.Name) and x.id == self_name]
+        if len(names) != len(attributes):
+            return None  # self被用于属性访问以外的地方
+
+        for attribute in attributes:
+            if attribute.attr in dependency_names:
+                used.add(attribute.attr)
+                continue
+            member = inspect.getattr_static(cls, attribute.attr, None)
+            if isinstance(member, property):
+                member = member.fget
+            if inspect.isfunction(member):
+                pending.append(member)
+    return used
+
+
+def _update_endpoint_self_param(
+        cls: Type[Any],
+        route: Union[Route, WebSocketRoute],
+        provider: Optional[Callable] = None
+) -> None:
     """
     调整endpoint的self参数，使其变为self=Depends(cls)
     这样每次处理依赖时，就可以实例化一个对象
+    :param provider: 替代cls作为self的依赖, 用于复用实例的作用域
     """
     old_endpoint = route.endpoint
     old_signature = inspect.signature(old_endpoint)
     old_parameters: List[inspect.Parameter] = list(old_signature.parameters.values())
     old_first_parameter = old_parameters[0]
-    new_first_parameter = old_first_parameter.replace(default=Depends(cls))
+    new_first_parameter = old_first_parameter.replace(default=Depends(provider or cls))
     new_parameters = [new_first_parameter] + [
         parameter.replace(kind=inspect.Parameter.KEYWORD_ONLY) for parameter in old_parameters[1:]
     ]
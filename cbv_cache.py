@@ -0,0 +1,126 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from starlette.requests import Request
+
+RawHeaders = List[Tuple[bytes, bytes]]
+
+
+class CacheEntry:
+    """已经序列化好的响应"""
+
+    __slots__ = ("body", "status_code", "headers", "etag")
+
+    def __init__(self, body: bytes, status_code: int, headers: RawHeaders, etag: str):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers
+        self.etag = etag
+
+
+class CacheBackend:
+    """
+    响应缓存的存储, namespace为路由("GET /user/{id}"), key为Cache.key_func的结果
+    方法都是协程, 以便实现基于网络的后端
+    """
+
+    async def get(self, namespace: str, key: Hashable) -> Optional[CacheEntry]:
+        raise NotImplementedError()
+
+    async def set(self, namespace: str, key: Hashable, entry: CacheEntry, ttl: Optional[float]) -> None:
+        raise NotImplementedError()
+
+    async def clear(self, namespace: str) -> None:
+        raise NotImplementedError()
+
+
+class MemoryBackend(CacheBackend):
+    """进程内的LRU, 每个namespace最多max_entries条, 过期的条目在读取时删除"""
+
+    def __init__(self, max_entries: int = 1024):
+        assert max_entries > 0, "max_entries必须大于0"
+        self.max_entries = max_entries
+        self.entries: Dict[str, "OrderedDict[Hashable, Tuple[Optional[float], CacheEntry]]"] = {}
+
+    async def get(self, namespace: str, key: Hashable) -> Optional[CacheEntry]:
+        entries = self.entries.get(namespace)
+        if entries is None:
+            return None
+        item = entries.get(key)
+        if item is None:
+            return None
+        deadline, entry = item
+        if deadline is not None and deadline <= time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return entry
+
+    async def set(self, namespace: str, key: Hashable, entry: CacheEntry, ttl: Optional[float]) -> None:
+        entries = self.entries.setdefault(namespace, OrderedDict())
+        entries[key] = (None if ttl is None else time.monotonic() + ttl, entry)
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+
+    async def clear(self, namespace: str) -> None:
+        self.entries.pop(namespace, None)
+
+
+def default_key(request: Request, values: Dict[str, Any]) -> Hashable:
+    """路径参数, 查询参数, 以及vary中列出的类依赖的值"""
+    return (
+        tuple(sorted(request.path_params.items())),
+        tuple(sorted(request.query_params.multi_items())),
+        tuple(sorted(values.items())),
+    )
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match可以是*或逗号分隔的多个ETag, 弱比较(忽略W/)"""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.replace("W/", "", 1) == etag:
+            return True
+    return False
+
+
+class Cache:
+    """
+    例:
+    @router.method(cache=Cache(ttl=60, max_entries=512, vary=["tenant"]))
+    def get(self): ...
+
+    @router.method(invalidates_cache=True)
+    def post(self): ...
+
+    router.method(cache=...)的配置, 命中时直接返回已序列化的响应, 不会实例化类, 也不会执行方法
+    只缓存2xx且没有set-cookie的响应; 所有响应都带有ETag, 请求的If-None-Match匹配时返回304
+    路由的dependencies与方法参数中的Depends在命中时仍会执行(认证失败照常返回401等);
+    但类依赖不会被解析, 类依赖中的认证(例如user: User = Depends(current_user))必须列在vary中,
+    否则缓存会在所有用户之间共享
+    :param ttl: 过期时间(秒), None为不过期
+    :param max_entries: 默认MemoryBackend的容量, 每个路由分别计算
+    :param vary: 参与缓存键的类依赖的名字(例如租户), 命中时也只解析这些依赖, 它们的值需要可以hash
+    :param key: 自定义缓存键, key(request, {类依赖名: 值}) -> Hashable, 默认使用default_key
+    :param backend: 存储, 默认为MemoryBackend(max_entries)
+    """
+
+    def __init__(
+            self,
+            ttl: Optional[float] = 60,
+            max_entries: int = 1024,
+            *,
+            vary: Sequence[str] = (),
+            key: Callable[[Request, Dict[str, Any]], Hashable] = default_key,
+            backend: Optional[CacheBackend] = None,
+    ):
+        self.ttl = ttl
+        self.vary = list(vary)
+        self.key = key
+        self.backend = backend or MemoryBackend(max_entries)
@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+try:
+    from .cbv_metrics import CBVMetrics
+except ImportError:
+    from cbv_metrics import CBVMetrics
+
+EXECUTORS: Dict[str, "CBVExecutor"] = {}
+
+
+class CBVExecutor:
+    """
+    例:
+    reports = CBVExecutor("reports", max_workers=4)
+    cpu = CBVExecutor("cpu", max_workers=2, kind="process")
+
+    @API(router, executor="reports")
+    class Report:
+        @router.method(executor=cpu)
+        def post(self, n: int): ...
+
+    独立的线程池或进程池, 按名字注册, CBVRouter(executor=...), API(executor=...), router.method(executor=...)
+    可以传入名字或实例; 池在第一次使用时创建, shutdown()之后再使用会重新创建
+    kind="thread": 同步方法与同步依赖在此运行, 与run_in_threadpool相同, 会复制contextvars
+    kind="process": 只能用于router.method(executor=...), 方法, self与参数都需要可以pickle
+        (方法所在的类需要定义在模块的顶层), 依赖仍在线程中解析
+    :param metrics: 记录"EXECUTOR <name>"的wait(排队)与run(执行, 进程池包括排队)耗时
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_workers: int = 4,
+            kind: str = "thread",
+            *,
+            metrics: Optional[CBVMetrics] = None,
+    ):
+        assert kind in ("thread", "process"), "kind只能是thread或process"
+        assert max_workers > 0, "max_workers必须大于0"
+        assert name not in EXECUTORS, f"名为{name}的CBVExecutor已经存在"
+        self.name = name
+        self.max_workers = max_workers
+        self.kind = kind
+        self.metrics = metrics
+        self.label = f"EXECUTOR {name}"
+        self.pool: Optional[Executor] = None
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        EXECUTORS[name] = self
+
+    def get_pool(self) -> Executor:
+        if self.pool is None:
+            if self.kind == "thread":
+                self.pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f"cbv-{self.name}")
+            else:
+                self.pool = ProcessPoolExecutor(self.max_workers)
+        return self.pool
+
+    async def run(self, func: Callable, args: Tuple[Any, ...] = (), kwargs: Optional[Dict[str, Any]] = None) -> Any:
+        """运行func(*args, **kwargs), kwargs中可能有名为self的参数, 所以不展开为run的参数"""
+        kwargs = kwargs or {}
+        loop = asyncio.get_event_loop()
+        pool = self.get_pool()
+        submitted = time.perf_counter()
+        self.submitted += 1
+        try:
+            if self.kind == "process":
+                return await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs))
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(pool, context.run, self._call, submitted, func, args, kwargs)
+        finally:
+            self.completed += 1
+            if self.metrics is not None:
+                self.metrics.observe(self.label, "run", time.perf_counter() - submitted)
+
+    def _call(self, submitted: float, func: Callable, args: Any, kwargs: Any) -> Any:
+        """在线程池中运行, 记录排队的时间"""
+        wait = time.perf_counter() - submitted
+        self.started += 1
+        self.wait_total += wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+        if self.metrics is not None:
+            self.metrics.observe(self.label, "wait", wait)
+        return func(*args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        queued: 已提交但尚未开始执行的数量(进程池无法得知何时开始, 按 未完成数 - max_workers 估算)
+        running: 正在执行的数量; wait_*: 线程池中的排队耗时(秒)
+        """
+        inflight = self.submitted - self.completed
+        if self.kind == "thread":
+            queued = self.submitted - self.started
+            running = self.started - self.completed
+        else:
+            queued = max(0, inflight - self.max_workers)
+            running = inflight - queued
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "queued": queued,
+            "running": running,
+            "wait_seconds_total": self.wait_total,
+            "wait_seconds_max": self.wait_max,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+def get_executor(executor: Union[str, CBVExecutor]) -> CBVExecutor:
+    if isinstance(executor, CBVExecutor):
+        return executor
+    assert executor in EXECUTORS, f"没有名为{executor}的CBVExecutor"
+    return EXECUTORS[executor]
+
+
+def executor_stats() -> Dict[str, Dict[str, Any]]:
+    """所有CBVExecutor的stats(), 按名字索引"""
+    return {name: executor.stats() for name, executor in EXECUTORS.items()}
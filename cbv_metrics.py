@@ -0,0 +1,93 @@
+from bisect import bisect_left
+from typing import Any, Dict, Optional, Sequence, Tuple
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.routing import Router
+
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Histogram:
+    """固定分桶的直方图, 与Prometheus的histogram相同, 桶的上界包含在桶内"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            cumulative[str(bound) if bound != float("inf") else "+Inf"] = total
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class CBVMetrics:
+    """
+    例:
+    metrics = CBVMetrics()
+    router = CBVRouter(path="/user", group_name="User", metrics=metrics)
+    metrics.mount(router, "/metrics")
+
+    class WebSocketTest(WebSocketBase, path="/ws", router=router, metrics=metrics): ...
+
+    按(路由, 阶段)记录耗时的直方图, 单位为秒
+    CBV的阶段: dependencies(类依赖的解析, 包括读取body), init(实例化), method(方法本身), total(整个请求)
+    WebSocket的阶段: decode(每条消息的解码), on_receive(每条消息的处理)
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, name: str = "cbv_phase_seconds"):
+        self.buckets = tuple(buckets)
+        self.name = name
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+
+    def observe(self, route: str, phase: str, seconds: float) -> None:
+        histogram = self.histograms.get((route, phase))
+        if histogram is None:
+            histogram = self.histograms[(route, phase)] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """{route: {phase: {"count", "sum", "buckets"}}}"""
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (route, phase), histogram in self.histograms.items():
+            result.setdefault(route, {})[phase] = histogram.snapshot()
+        return result
+
+    def reset(self) -> None:
+        self.histograms.clear()
+
+    def render_prometheus(self) -> str:
+        lines = [
+            f"# HELP {self.name} Latency of CBV endpoint phases in seconds.",
+            f"# TYPE {self.name} histogram",
+        ]
+        for (route, phase), histogram in sorted(self.histograms.items()):
+            labels = f'route="{_escape(route)}",phase="{phase}"'
+            for bound, count in histogram.snapshot()["buckets"].items():
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{self.name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def endpoint(self, request: Request) -> PlainTextResponse:
+        return PlainTextResponse(self.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    def mount(self, router: Router, path: str = "/metrics", name: Optional[str] = None) -> None:
+        """在router上注册Prometheus文本格式的路由, 不会出现在文档中"""
+        router.add_route(path, self.endpoint, methods=["GET"], name=name, include_in_schema=False)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Type
+from fastapi.dependencies.utils import get_flat_params
+from fastapi.encoders import jsonable_encoder
+from fastapi.openapi.utils import get_flat_models_from_routes, get_openapi_path
+from fastapi.routing import APIRoute
+from fastapi.utils import get_model_definitions
+from pydantic.schema import get_model_name_map
+
+try:
+    from .cbv import CBV_OPTIONS_KEY
+except ImportError:
+    from cbv import CBV_OPTIONS_KEY
+try:
+    from .temp_router import get_response_class
+except ImportError:
+    from temp_router import get_response_class
+
+# 缓存文件的格式版本, 格式变化时旧文件自动失效
+_FORMAT = 1
+
+
+class OpenAPIFragment:
+    """
+    一组路由(通常是一个CBVRouter在app中的路由)的schema片段, 已经编码为json兼容的dict
+    paths: 路由的key -> (path_format, {method: operation}), 合并时按app中路由的顺序
+    """
+
+    __slots__ = ("paths", "schemas", "security_schemes")
+
+    def __init__(self, paths: Dict[Hashable, Tuple[str, Dict[str, Any]]], schemas: Dict[str, Any],
+                 security_schemes: Dict[str, Any]):
+        self.paths = paths
+        self.schemas = schemas
+        self.security_schemes = security_schemes
+
+
+def _route_key(route: APIRoute) -> Hashable:
+    return route.path_format, tuple(sorted(route.methods)), route.unique_id
+
+
+def _get_owner(route: APIRoute) -> Optional[Any]:
+    """route所属的CBVRouter, 由add_cbv_route记录在endpoint的配置上"""
+    options = getattr(route.endpoint, CBV_OPTIONS_KEY, None) or {}
+    return options.get("router")
+
+
+def build_fragment(routes: List[APIRoute], model_name_map: Dict[Type[Any], str]) -> OpenAPIFragment:
+    """
+    与get_openapi()相同的方式生成routes的paths与components
+    get_openapi_path与模型的定义已经是json兼容的dict, 不再经过OpenAPI模型的校验(这是get_openapi()中最慢的部分)
+    """
+    paths: Dict[Hashable, Tuple[str, Dict[str, Any]]] = {}
+    security_schemes: Dict[str, Any] = {}
+    models = get_flat_models_from_routes(routes)
+    definitions = get_model_definitions(flat_models=models, model_name_map=model_name_map)
+    for route in routes:
+        path, route_security, path_definitions = get_openapi_path(route=route, model_name_map=model_name_map)
+        if path:
+            paths[_route_key(route)] = (route.path_format, jsonable_encoder(path))
+        security_schemes.update(route_security)
+        definitions.update(path_definitions)
+    return OpenAPIFragment(paths, definitions, jsonable_encoder(security_schemes, by_alias=True, exclude_none=True))
+
+
+class CBVOpenAPI:
+    """
+    例:
+    app = FastAPI()
+    app.include_router(router)
+    install_openapi(app, path="openapi.json")
+
+    代替app.openapi(), 按CBVRouter分片生成schema:
+    每个CBVRouter的片段生成一次后缓存在router.openapi_fragments中, 再次生成(新增了路由, 同一router被多个app使用)时
+    只需为变化的部分生成片段, 其他路由(非CBV)每次重新生成; 片段直接合并, 不再对整个文档做一次校验
+    :param path: 保存schema的文件, 文件存在且指纹一致时直接读取, 否则生成后写入
+    :param fingerprint: 代替自动计算的指纹(例如发布的版本号), 省去启动时遍历路由与模型的开销
+        自动计算的指纹包括app的标题/版本等, 各路由的路径/方法/参数/endpoint, 以及用到的模型的字段
+        模型的Config.schema_extra, 字段的description等不在其中, 修改它们时请删除文件或传入fingerprint
+    :param warm: 在app启动(on_startup)时生成或读取schema, 第一次访问/openapi.json时不再阻塞
+    """
+
+    def __init__(self, app: Any, *, path: Optional[str] = None, fingerprint: Optional[str] = None,
+                 warm: bool = True):
+        self.app = app
+        self.path = path
+        self.fingerprint = fingerprint
+        self.loaded = False
+        if warm:
+            app.router.add_event_handler("startup", self.warm)
+
+    def __call__(self) -> Dict[str, Any]:
+        app = self.app
+        if not app.openapi_schema:
+            schema = self.load() if self.path else None
+            self.loaded = schema is not None
+            if schema is None:
+                schema = self.build()
+                if self.path:
+                    self.save(schema)
+            app.openapi_schema = schema
+        # 与FastAPI相同, root_path在第一次请求/openapi.json时才加入servers
+        if app.servers:
+            app.openapi_schema["servers"] = app.servers
+        return app.openapi_schema
+
+    def warm(self) -> None:
+        self()
+
+    def get_fingerprint(self) -> str:
+        if self.fingerprint is not None:
+            return self.fingerprint
+        app = self.app
+        routes = [route for route in app.routes if isinstance(route, APIRoute) and route.include_in_schema]
+        items: List[Any] = [
+            _FORMAT, app.title, app.version, app.openapi_version, app.description, app.openapi_tags
+        ]
+        for route in routes:
+            fields = get_flat_params(route.dependant)
+            if route.body_field is not None:
+                fields.append(route.body_field)
+            items.append((
+                route.path_format, sorted(route.methods), route.unique_id, route.summary, route.description,
+                route.tags, route.deprecated, route.status_code, route.response_description, repr(route.responses),
+                route.operation_id, get_response_class(route.response_class).__name__,
+                f"{route.endpoint.__module__}.{route.endpoint.__qualname__}", [_describe_field(field) for field in fields],
+                None if route.response_field is None else _describe_field(route.response_field),
+            ))
+        for model in sorted(get_flat_models_from_routes(routes), key=lambda m: f"{m.__module__}.{m.__qualname__}"):
+            fields = getattr(model, "__fields__", None)
+            items.append((
+                f"{model.__module__}.{model.__qualname__}", model.__doc__,
+                None if fields is None else [_describe_field(field) for field in fields.values()],
+            ))
+        raw = json.dumps(items, default=repr).encode("utf-8")
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+    def build(self) -> Dict[str, Any]:
+        app = self.app
+        routes = [route for route in app.routes if isinstance(route, APIRoute)]
+        model_name_map = get_model_name_map(get_flat_models_from_routes(routes))
+
+        # 按所属的CBVRouter分组, 保持第一次出现的顺序
+        groups: Dict[int, Tuple[Optional[Any], List[APIRoute]]] = {}
+        for route in routes:
+            owner = _get_owner(route)
+            groups.setdefault(id(owner), (owner, []))[1].append(route)
+
+        fragments: List[OpenAPIFragment] = []
+        route_fragments: Dict[Hashable, OpenAPIFragment] = {}
+        for owner, group in groups.values():
+            if owner is None:
+                fragment = build_fragment(group, model_name_map)
+            else:
+                fragment = get_fragment(owner, group, model_name_map)
+            fragments.append(fragment)
+            for key in fragment.paths:
+                route_fragments[key] = fragment
+
+        info = {"title": app.title, "version": app.version}
+        if app.description:
+            info["description"] = app.description
+        output: Dict[str, Any] = {"openapi": app.openapi_version, "info": info}
+        if app.servers:
+            output["servers"] = app.servers
+        paths: Dict[str, Dict[str, Any]] = {}
+        for route in routes:
+            key = _route_key(route)
+            fragment = route_fragments.get(key)
+            if fragment is not None:
+                path_format, item = fragment.paths[key]
+                paths.setdefault(path_format, {}).update(item)
+        output["paths"] = paths
+        schemas: Dict[str, Any] = {}
+        security_schemes: Dict[str, Any] = {}
+        for fragment in fragments:
+            schemas.update(fragment.schemas)
+            security_schemes.update(fragment.security_schemes)
+        components: Dict[str, Any] = {}
+        if schemas:
+            components["schemas"] = {name: schemas[name] for name in sorted(schemas)}
+        if security_schemes:
+            components["securitySchemes"] = security_schemes
+        if components:
+            output["components"] = components
+        if app.openapi_tags:
+            output["tags"] = jsonable_encoder(app.openapi_tags, by_alias=True, exclude_none=True)
+        return output
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """文件不存在, 无法解析或指纹不一致时返回None"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get("fingerprint") != self.get_fingerprint():
+            return None
+        return data.get("schema")
+
+    def save(self, schema: Dict[str, Any]) -> None:
+        """先写入临时文件再替换, 多个worker同时启动时不会读到写了一半的文件"""
+        data = {"fingerprint": self.get_fingerprint(), "schema": schema}
+        temp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False)
+            os.replace(temp, self.path)
+        finally:
+            # 写入或替换失败时不留下临时文件
+            if os.path.exists(temp):
+                os.remove(temp)
+
+
+def _describe_field(field: Any) -> Tuple[Any, ...]:
+    return field.name, field.alias, repr(field.outer_type_), field.required, repr(field.default), \
+        type(field.field_info).__name__
+
+
+def get_fragment(router: Any, routes: List[APIRoute], model_name_map: Dict[Type[Any], str]) -> OpenAPIFragment:
+    """
+    router在app中的路由对应的片段, 路由与所用模型的名字都没有变化时直接使用缓存
+    (模型的名字由整个app决定, 其他router加入同名的模型时会改变)
+    """
+    models = get_flat_models_from_routes(routes)
+    key = (
+        tuple(_route_key(route) for route in routes),
+        tuple(sorted(model_name_map[model] for model in models)),
+    )
+    fragment = router.openapi_fragments.get(key)
+    if fragment is None:
+        fragment = router.openapi_fragments[key] = build_fragment(routes, model_name_map)
+    return fragment
+
+
+def install_openapi(app: Any, *, path: Optional[str] = None, fingerprint: Optional[str] = None,
+                    warm: bool = True) -> CBVOpenAPI:
+    """用CBVOpenAPI替换app.openapi, 参数见CBVOpenAPI"""
+    openapi = CBVOpenAPI(app, path=path, fingerprint=fingerprint, warm=warm)
+    app.openapi = openapi
+    app.openapi_schema = None
+    return openapi
@@ -0,0 +1,110 @@
+import inspect
+from typing import Any, Callable, List, Optional
+
+_UNSET = object()
+
+
+class Resource:
+    """
+    例:
+    async def make_client():
+        client = httpx.AsyncClient()
+        yield client
+        await client.aclose()
+
+    @API(router)
+    class User:
+        client: httpx.AsyncClient = Resource(make_client)
+        pool = Resource(create_pool, close=lambda pool: pool.close())
+
+    在应用启动时创建一次, 关闭时释放的共享资源, 每个worker进程一份
+    声明在@API的类或WebSocketBase的子类上, 由其router的on_startup/on_shutdown管理, 不是类依赖,
+    实例通过描述符直接读取, 每个请求不需要解析或赋值
+    :param factory: 创建资源, 可以是普通函数, 协程函数, 生成器或异步生成器(yield之后的代码在关闭时运行)
+    :param close: 关闭资源的函数(可以是协程函数), 参数为资源
+        不写时依次尝试资源的aclose(), close(); factory为生成器时由生成器自己负责
+    """
+
+    def __init__(self, factory: Callable[[], Any], *, close: Optional[Callable[[Any], Any]] = None):
+        self.factory = factory
+        self.close = close
+        self.name = getattr(factory, "__name__", "resource")
+        self.named = False
+        self.value: Any = _UNSET
+        self.generator: Any = None
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        # 同一个Resource可以被赋给多个类, 以第一次声明的位置命名
+        if not self.named:
+            self.name = f"{owner.__name__}.{name}"
+            self.named = True
+
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Any:
+        if instance is None:
+            return self
+        value = self.value
+        if value is _UNSET:
+            raise RuntimeError(f"资源{self.name}尚未创建, 请确认其所在的router已被include_router, 且应用已经启动")
+        return value
+
+    @property
+    def opened(self) -> bool:
+        return self.value is not _UNSET
+
+    async def startup(self) -> None:
+        """创建资源, 已经创建时(例如被多个router注册)不会重复创建"""
+        if self.opened:
+            return
+        factory = self.factory
+        if inspect.isasyncgenfunction(factory):
+            self.generator = factory()
+            value = await self.generator.__anext__()
+        elif inspect.isgeneratorfunction(factory):
+            self.generator = factory()
+            value = next(self.generator)
+        else:
+            value = factory()
+            if inspect.isawaitable(value):
+                value = await value
+        self.value = value
+
+    async def shutdown(self) -> None:
+        if not self.opened:
+            return
+        value, self.value = self.value, _UNSET
+        generator, self.generator = self.generator, None
+        if generator is not None:
+            if inspect.isasyncgen(generator):
+                async for _ in generator:
+                    pass
+            else:
+                for _ in generator:
+                    pass
+            return
+        close = self.close
+        if close is None:
+            close = getattr(value, "aclose", None) or getattr(value, "close", None)
+            result = close() if close is not None else None
+        else:
+            result = close(value)
+        if inspect.isawaitable(result):
+            await result
+
+
+def get_resources(cls: type) -> List[Resource]:
+    """类及其父类上声明的Resource"""
+    resources: List[Resource] = []
+    for klass in reversed(cls.__mro__):
+        for value in vars(klass).values():
+            if isinstance(value, Resource) and value not in resources:
+                resources.append(value)
+    return resources
+
+
+def register_resources(cls: type, router: Any) -> None:
+    """把类上的Resource挂到router的on_startup/on_shutdown, 同一个Resource只注册一次"""
+    for resource in get_resources(cls):
+        if resource.startup not in router.on_startup:
+            router.add_event_handler("startup", resource.startup)
+        if resource.shutdown not in router.on_shutdown:
+            router.add_event_handler("shutdown", resource.shutdown)
@@ -1,6 +1,13 @@
-from typing import ClassVar
-from fastapi import Depends
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from typing import Any, ClassVar, Dict, List, Optional, Tuple
+from fastapi import Depends, FastAPI, Header, HTTPException
 from cbv import API, CBVRouter
+from cbv_cache import Cache
+from cbv_openapi import install_openapi
 
 
 def dependency(num: int) -> int:
@@ -29,9 +36,251 @@ class TestClass:
         return hasattr(self, "cy")
 
 
+# 子类继承类依赖与路由方法, 自己的__init__中调用super().__init__()
+@API(router, path="/admin")
+class AdminClass(TestClass):
+    level: int = Depends(dependency)
+
+    def __init__(self, z: int = Depends(dependency)):
+        super().__init__(z)
+        self.y = self.level
+
+    @router.method(response_model=int)
+    def put(self) -> int:
+        return self.x + self.y + self.z + self.level
+
+
+async def _call(
+        app: Any, method: str, path: str, *, headers: Optional[Dict[str, str]] = None, body: Any = None
+) -> Tuple[int, Dict[str, str], Any]:
+    """在进程内直接调用ASGI应用(同bench.py), 返回状态码, 响应头和解析后的json"""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 80),
+    }
+    messages = [{"type": "http.request", "body": b"" if body is None else json.dumps(body).encode()}]
+    status = 0
+    response_headers: Dict[str, str] = {}
+    chunks: List[bytes] = []
+
+    async def receive() -> Dict[str, Any]:
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers.update((k.decode(), v.decode()) for k, v in message["headers"])
+        else:
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    content = b"".join(chunks)
+    return status, response_headers, json.loads(content) if content and method != "HEAD" else None
+
+
+async def check_inheritance() -> None:
+    """子类继承类依赖与路由方法, super().__init__()中的赋值依然有效"""
+    app = FastAPI()
+    app.include_router(router)
+    assert (await _call(app, "GET", "/user?num=2"))[2] == 1 + 2 + 1 + 2
+    assert (await _call(app, "GET", "/user/admin?num=3"))[2] == 1 + 3 + 3 + 3
+    assert (await _call(app, "PUT", "/user/admin?num=3"))[2] == 3 + 3 + 3 + 3
+    assert (await _call(app, "POST", "/user/admin?num=1"))[2] is False
+
+
+async def check_dispatch() -> None:
+    """同一个CBVRouter被include两次时, 各自的dependencies都有效"""
+    def admin_only(x_admin: str = Header(None)) -> None:
+        if x_admin != "yes":
+            raise HTTPException(403)
+
+    dispatch_router = CBVRouter("", "Dispatch")
+
+    @API(dispatch_router, path="/d", dispatch=True)
+    class Dispatch:
+        @dispatch_router.method()
+        def get(self) -> int:
+            return 1
+
+        @dispatch_router.method()
+        def post(self) -> int:
+            return 2
+
+    app = FastAPI()
+    app.include_router(dispatch_router, prefix="/v1")
+    app.include_router(dispatch_router, prefix="/admin", dependencies=[Depends(admin_only)])
+    assert (await _call(app, "GET", "/v1/d"))[2] == 1
+    assert (await _call(app, "POST", "/admin/d"))[0] == 403
+    assert (await _call(app, "GET", "/admin/d", headers={"x-admin": "yes"}))[2] == 1
+    assert (await _call(app, "HEAD", "/v1/d"))[0] == 200
+    status, headers, _ = await _call(app, "DELETE", "/v1/d")
+    assert status == 405 and headers["allow"] == "GET, HEAD, POST"
+
+
+async def check_batch() -> None:
+    """批量接口: 单项异常返回500并记录日志, 文档可以正常生成"""
+    records: List[logging.LogRecord] = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    batch_router = CBVRouter("", "Batch")
+
+    @API(batch_router, path="/b", batch=True)
+    class Batch:
+        @batch_router.method()
+        def get(self, x: int = 0) -> int:
+            if x == 1:
+                raise ValueError(x)
+            return x
+
+    app = FastAPI()
+    app.include_router(batch_router)
+    logging.getLogger("cbv").addHandler(handler)
+    try:
+        _, _, body = await _call(app, "POST", "/b/_batch", body=[
+            {"method": "get", "params": {"x": 2}}, {"method": "get", "params": {"x": 1}}
+        ])
+    finally:
+        logging.getLogger("cbv").removeHandler(handler)
+    assert body == [{"status": 200, "body": 2}, {"status": 500, "body": {"detail": "Internal Server Error"}}]
+    assert records and records[0].exc_info[0] is ValueError
+    assert "/b/_batch" in app.openapi()["paths"]
+
+
+async def check_openapi() -> None:
+    """schema文件的生成与读取, 写入失败时不留下临时文件"""
+    app = FastAPI()
+    app.include_router(router)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "openapi.json")
+    openapi = install_openapi(app, path=path, warm=False)
+    paths = (await _call(app, "GET", "/openapi.json"))[2]["paths"]
+    assert "/user/admin" in paths and not openapi.loaded and os.path.exists(path)
+    reloaded = install_openapi(app, path=path, warm=False)
+    assert reloaded()["paths"] == paths and reloaded.loaded
+    try:
+        openapi.save({"value": object()})
+    except TypeError:
+        pass
+    assert os.listdir(directory) == ["openapi.json"]
+
+
+async def check_slots() -> None:
+    """slots=True时, uses之外的依赖不会被解析, 其他方法依然可以使用它们的slot"""
+    calls: List[int] = []
+
+    def other() -> str:
+        calls.append(1)
+        return "y"
+
+    slots_router = CBVRouter("", "Slots")
+
+    @API(slots_router, path="/s", slots=True)
+    class Slots:
+        __slots__ = ()
+        x: int = Depends(dependency)
+        y: str = Depends(other)
+
+        @slots_router.method(uses=["x"])
+        def get(self) -> int:
+            return self.x
+
+        @slots_router.method()
+        def post(self) -> List[Any]:
+            # y依然保存在slot中, 而不是__dict__
+            return [self.x, self.y, "y" in getattr(self, "__dict__", {})]
+
+    app = FastAPI()
+    app.include_router(slots_router)
+    assert (await _call(app, "GET", "/s?num=4"))[2] == 4 and not calls
+    assert (await _call(app, "POST", "/s?num=4"))[2] == [4, "y", False] and calls == [1]
+
+
+async def check_cache() -> None:
+    """缓存未命中时vary的依赖只解析一次, 命中时路由的dependencies依然会检查"""
+    calls: List[str] = []
+
+    def tenant(x_tenant: str = Header("t0")) -> str:
+        calls.append(x_tenant)
+        return x_tenant
+
+    def auth(authorization: str = Header(None)) -> None:
+        if authorization != "ok":
+            raise HTTPException(401)
+
+    cache_router = CBVRouter("", "Cache")
+
+    @API(cache_router, path="/c")
+    class Cached:
+        t: str = Depends(tenant)
+
+        @cache_router.method(cache=Cache(ttl=60, vary=["t"]), dependencies=[Depends(auth)])
+        def get(self) -> str:
+            return self.t
+
+    app = FastAPI()
+    app.include_router(cache_router)
+    ok = {"authorization": "ok"}
+    assert (await _call(app, "GET", "/c", headers=ok))[2] == "t0" and calls == ["t0"]
+    assert (await _call(app, "GET", "/c", headers=ok))[2] == "t0" and calls == ["t0", "t0"]
+    assert (await _call(app, "GET", "/c"))[0] == 401
+    assert (await _call(app, "GET", "/c", headers={"x-tenant": "t1", **ok}))[2] == "t1"
+    assert calls[-1] == "t1" and len(calls) == 4
+
+
+async def check_app_scope() -> None:
+    """scope="app"/"pooled"的实例在启动时按app的dependency_overrides创建"""
+    def connect() -> str:
+        return "real"
+
+    for scope in ("app", "pooled"):
+        scoped_router = CBVRouter("", "Scoped")
+
+        @API(scoped_router, path="/a", scope=scope, pool_size=2)
+        class Scoped:
+            connection: str = Depends(connect)
+
+            @scoped_router.method()
+            def get(self) -> str:
+                return self.connection
+
+        app = FastAPI()
+        app.include_router(scoped_router)
+        app.dependency_overrides[connect] = lambda: "fake"
+        await app.router.startup()
+        assert (await _call(app, "GET", "/a"))[2] == "fake"
+        await app.router.shutdown()
+        other = FastAPI()
+        other.include_router(scoped_router)
+        assert (await _call(other, "GET", "/a"))[2] == "real"
+
+
+def check() -> None:
+    """python cbv_test.py check"""
+    for func in (
+            check_inheritance, check_dispatch, check_batch, check_openapi, check_slots, check_cache, check_app_scope
+    ):
+        asyncio.run(func())
+        print(f"{func.__name__}: ok")
+
+
 if __name__ == '__main__':
-    from fastapi import FastAPI
+    import sys
+    if sys.argv[1:] == ["check"]:
+        check()
+        sys.exit()
     app = FastAPI()
     app.include_router(router)
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8888)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8888)
@@ -1,11 +1,27 @@
 from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Type, Union
 from starlette import routing
-from starlette.responses import Response
+from starlette.responses import JSONResponse, Response
 from starlette.routing import get_name
 from starlette.types import ASGIApp
 from fastapi import params
 from fastapi.encoders import DictIntStrAny, SetIntStr
-from fastapi.routing import APIRoute, APIRouter
+from fastapi.routing import APIRoute, APIRouter, APIWebSocketRoute
+
+# fastapi>=0.62用DefaultPlaceholder标记未设置的response_class, include_router时才替换为router或app的默认值,
+# 显式的None会被原样保留而在请求时出错; 更早的版本中None即表示未设置
+try:
+    from fastapi.datastructures import Default, DefaultPlaceholder
+    DEFAULT_RESPONSE_CLASS: Any = Default(JSONResponse)
+except ImportError:
+    DefaultPlaceholder = None
+    DEFAULT_RESPONSE_CLASS = None
+
+
+def get_response_class(response_class: Any) -> Type[Response]:
+    """路由实际使用的response_class(去掉DefaultPlaceholder, None时为JSONResponse)"""
+    if DefaultPlaceholder is not None and isinstance(response_class, DefaultPlaceholder):
+        response_class = response_class.value
+    return response_class or JSONResponse
 
 
 class TempRoute:
@@ -69,6 +85,21 @@ class TempRoute:
         self.callbacks = callbacks
 
 
+class TempWebSocketRoute:
+    def __init__(
+            self,
+            path: str,
+            endpoint: Callable,
+            *,
+            name: Optional[str] = None,
+            dependency_overrides_provider: Optional[Any] = None,
+    ) -> None:
+        self.path = path
+        self.endpoint = endpoint
+        self.name = get_name(endpoint) if name is None else name
+        self.dependency_overrides_provider = dependency_overrides_provider
+
+
 class TempRouter(APIRouter):
     def __init__(
             self,
@@ -89,7 +120,7 @@ class TempRouter(APIRouter):
             on_shutdown=on_shutdown,
             dependency_overrides_provider=dependency_overrides_provider,
             route_class=route_class,
-            default_response_class=default_response_class
+            default_response_class=default_response_class or DEFAULT_RESPONSE_CLASS
         )
 
     def add_api_route(
@@ -142,10 +173,22 @@ class TempRouter(APIRouter):
             response_model_exclude_defaults=response_model_exclude_defaults,
             response_model_exclude_none=response_model_exclude_none,
             include_in_schema=include_in_schema,
-            response_class=response_class or self.default_response_class,
+            response_class=response_class or self.default_response_class or DEFAULT_RESPONSE_CLASS,
             name=name,
             dependency_overrides_provider=self.dependency_overrides_provider,
             callbacks=callbacks,
         )
         route.__class__ = APIRoute
         self.routes.append(route)
+
+    def add_api_websocket_route(
+            self, path: str, endpoint: Callable, name: Optional[str] = None
+    ) -> None:
+        route = TempWebSocketRoute(
+            path,
+            endpoint=endpoint,
+            name=name,
+            dependency_overrides_provider=self.dependency_overrides_provider,
+        )
+        route.__class__ = APIWebSocketRoute
+        self.routes.append(route)
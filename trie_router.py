@@ -0,0 +1,159 @@
+import re
+from typing import Any, Dict, List, Optional, Tuple
+from starlette.convertors import PathConvertor
+from starlette.datastructures import URL
+from starlette.responses import RedirectResponse
+from starlette.routing import BaseRoute, Match
+from starlette.types import Receive, Scope, Send
+from fastapi.routing import APIRouter
+
+PARAM_REGEX = re.compile(r"{([a-zA-Z_][a-zA-Z0-9_]*)}")
+
+
+class _Node:
+    __slots__ = ("static", "param", "routes", "tails")
+
+    def __init__(self):
+        self.static: Dict[str, "_Node"] = {}
+        self.param: Optional["_Node"] = None
+        # 路径在此结束的路由, 以及从此往后可以匹配任意剩余路径的路由({path:path}, Mount)
+        self.routes: List[int] = []
+        self.tails: List[int] = []
+
+
+class RouteIndex:
+    """
+    按路径分段建立的前缀树, 查找可能匹配某个路径的路由, 耗时只与路径的深度有关
+    返回的候选路由保持原本的顺序, 仍然由route.matches()做最终的判断, 所以匹配的语义不变
+    没有path_format的路由(例如Host)总是作为候选
+    """
+
+    def __init__(self, routes: List[BaseRoute]):
+        self.root = _Node()
+        self.always: List[int] = []
+        for index, route in enumerate(routes):
+            self._add(index, route)
+
+    def _add(self, index: int, route: BaseRoute) -> None:
+        path_format = getattr(route, "path_format", None)
+        convertors = getattr(route, "param_convertors", None)
+        if path_format is None or convertors is None or not path_format.startswith("/"):
+            self.always.append(index)
+            return
+
+        node = self.root
+        for segment in path_format.split("/")[1:]:
+            names = PARAM_REGEX.findall(segment)
+            if any(isinstance(convertors.get(name), PathConvertor) for name in names):
+                node.tails.append(index)
+                return
+            if names:
+                if node.param is None:
+                    node.param = _Node()
+                node = node.param
+            else:
+                node = node.static.setdefault(segment, _Node())
+        node.routes.append(index)
+
+    def candidates(self, path: str) -> List[int]:
+        found = list(self.always)
+        nodes = [self.root]
+        for segment in path.split("/")[1:]:
+            next_nodes = []
+            for node in nodes:
+                found.extend(node.tails)
+                child = node.static.get(segment)
+                if child is not None:
+                    next_nodes.append(child)
+                if node.param is not None:
+                    next_nodes.append(node.param)
+            nodes = next_nodes
+            if not nodes:
+                break
+        for node in nodes:
+            found.extend(node.tails)
+            found.extend(node.routes)
+        found.sort()
+        return found
+
+
+class TrieRouter(APIRouter):
+    """
+    使用RouteIndex查找路由的APIRouter, 适合注册了大量CBVRouter/TempRouter的应用
+    一般通过use_trie_router(app)替换app.router的类来使用
+    routes被修改(追加或替换)后, 索引会在下一次请求时重建
+    """
+
+    _index: Optional[Tuple[int, int, RouteIndex]] = None
+
+    def get_index(self) -> RouteIndex:
+        index = self._index
+        if index is None or index[0] != id(self.routes) or index[1] != len(self.routes):
+            index = (id(self.routes), len(self.routes), RouteIndex(self.routes))
+            self._index = index
+        return index[2]
+
+    def lookup(self, scope: Scope) -> Tuple[Match, Optional[BaseRoute], Scope]:
+        """
+        与Router.__call__中的查找逻辑相同: 返回第一个FULL匹配, 否则返回第一个PARTIAL匹配
+        """
+        routes = self.routes
+        partial = None
+        partial_scope: Scope = {}
+        for i in self.get_index().candidates(scope["path"]):
+            route = routes[i]
+            match, child_scope = route.matches(scope)
+            if match == Match.FULL:
+                return match, route, child_scope
+            elif match == Match.PARTIAL and partial is None:
+                partial = route
+                partial_scope = child_scope
+        if partial is not None:
+            return Match.PARTIAL, partial, partial_scope
+        return Match.NONE, None, {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        assert scope["type"] in ("http", "websocket", "lifespan")
+
+        if "router" not in scope:
+            scope["router"] = self
+
+        if scope["type"] == "lifespan":
+            await self.lifespan(scope, receive, send)
+            return
+
+        match, route, child_scope = self.lookup(scope)
+        if route is not None:
+            scope.update(child_scope)
+            await route.handle(scope, receive, send)
+            return
+
+        if scope["type"] == "http" and self.redirect_slashes and scope["path"] != "/":
+            redirect_scope = dict(scope)
+            if scope["path"].endswith("/"):
+                redirect_scope["path"] = redirect_scope["path"].rstrip("/")
+            else:
+                redirect_scope["path"] = redirect_scope["path"] + "/"
+
+            match, route, child_scope = self.lookup(redirect_scope)
+            if match != Match.NONE:
+                redirect_url = URL(scope=redirect_scope)
+                response = RedirectResponse(url=str(redirect_url))
+                await response(scope, receive, send)
+                return
+
+        await self.default(scope, receive, send)
+
+
+def use_trie_router(app: Any) -> Any:
+    """
+    例:
+    app = FastAPI()
+    app.include_router(router)
+    use_trie_router(app)
+
+    将app.router替换为TrieRouter, 已注册的路由与事件不受影响
+    """
+    assert isinstance(app.router, APIRouter), "app.router必须是APIRouter"
+    app.router.__class__ = TrieRouter
+    return app
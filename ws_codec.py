@@ -0,0 +1,141 @@
+import json
+from typing import Any, Dict, Optional, Union
+from starlette.types import Message
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class CodecError(ValueError):
+    """消息无法解码, WebSocketBase会以1003关闭连接"""
+
+
+class Codec:
+    """
+    WebSocket消息的编解码器
+    decode: websocket.receive消息 -> 数据
+    encode: 数据 -> websocket.send消息
+    """
+
+    name = None
+
+    def decode(self, message: Message) -> Any:
+        return message["text"] if message.get("text") is not None else message["bytes"]
+
+    def encode(self, data: Any) -> Message:
+        """str为文本, bytes为二进制, 其他为json"""
+        if isinstance(data, str):
+            return {"type": "websocket.send", "text": data}
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return {"type": "websocket.send", "bytes": bytes(data)}
+        return {"type": "websocket.send", "text": json.dumps(data)}
+
+
+class TextCodec(Codec):
+    name = "text"
+
+    def decode(self, message: Message) -> Any:
+        text = message.get("text")
+        if text is None:
+            raise CodecError("Expected text websocket messages, but got bytes")
+        return text
+
+    def encode(self, data: Any) -> Message:
+        return {"type": "websocket.send", "text": data}
+
+
+class BytesCodec(Codec):
+    name = "bytes"
+
+    def decode(self, message: Message) -> Any:
+        data = message.get("bytes")
+        if data is None:
+            raise CodecError("Expected bytes websocket messages, but got text")
+        return data
+
+    def encode(self, data: Any) -> Message:
+        return {"type": "websocket.send", "bytes": data}
+
+
+class JSONCodec(Codec):
+    """
+    安装了orjson时使用orjson, 否则使用标准库json
+    二进制帧直接交给loads, 不先解码为str
+    binary=True时以二进制帧发送(orjson的输出不需要再解码为str)
+    """
+
+    name = "json"
+
+    def __init__(self, binary: bool = False, use_orjson: bool = True):
+        self.binary = binary
+        self.orjson = use_orjson and orjson is not None
+
+    def decode(self, message: Message) -> Any:
+        data = message.get("text")
+        if data is None:
+            data = message["bytes"]
+        try:
+            if self.orjson:
+                return orjson.loads(data)
+            return json.loads(data)
+        except ValueError:
+            raise CodecError("Malformed JSON data received.") from None
+
+    def encode(self, data: Any) -> Message:
+        if self.orjson:
+            raw = orjson.dumps(data)
+            if self.binary:
+                return {"type": "websocket.send", "bytes": raw}
+            return {"type": "websocket.send", "text": raw.decode("utf-8")}
+        text = json.dumps(data)
+        if self.binary:
+            return {"type": "websocket.send", "bytes": text.encode("utf-8")}
+        return {"type": "websocket.send", "text": text}
+
+
+class MsgPackCodec(Codec):
+    """需要安装msgpack, 以二进制帧收发"""
+
+    name = "msgpack"
+
+    def __init__(self):
+        assert msgpack is not None, "使用MsgPackCodec需要安装msgpack"
+
+    def decode(self, message: Message) -> Any:
+        data = message.get("bytes")
+        if data is None:
+            raise CodecError("Expected bytes websocket messages, but got text")
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (ValueError, msgpack.UnpackException):
+            raise CodecError("Malformed msgpack data received.") from None
+
+    def encode(self, data: Any) -> Message:
+        return {"type": "websocket.send", "bytes": msgpack.packb(data, use_bin_type=True)}
+
+
+CODECS: Dict[Optional[str], Any] = {
+    None: Codec,
+    "text": TextCodec,
+    "bytes": BytesCodec,
+    "json": JSONCodec,
+    "msgpack": MsgPackCodec,
+}
+_instances: Dict[Optional[str], Codec] = {}
+
+
+def get_codec(encoding: Union[None, str, Codec]) -> Codec:
+    """encoding可以是Codec实例, 或CODECS中的名字, 按名字获取的实例会被复用"""
+    if isinstance(encoding, Codec):
+        return encoding
+    assert encoding in CODECS, f"Unsupported 'encoding' attribute {encoding}"
+    codec = _instances.get(encoding)
+    if codec is None:
+        codec = _instances[encoding] = CODECS[encoding]()
+    return codec
@@ -0,0 +1,144 @@
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+from starlette.types import Message
+from starlette.websockets import WebSocket
+
+try:
+    from .ws_codec import Codec, get_codec
+except ImportError:
+    from ws_codec import Codec, get_codec
+
+ALL = ""
+
+
+class HubBackend:
+    """
+    连接注册表的后端, 负责记录房间的成员, 以及把消息送到房间的每个成员
+    members只返回本进程内的连接; 跨进程的后端可以在publish中把消息转发给其他进程,
+    由其他进程调用各自的deliver发送给本地的连接
+    """
+
+    async def join(self, room: str, websocket: WebSocket) -> None:
+        raise NotImplementedError()
+
+    async def leave(self, room: str, websocket: WebSocket) -> None:
+        raise NotImplementedError()
+
+    async def rooms_of(self, websocket: WebSocket) -> List[str]:
+        raise NotImplementedError()
+
+    async def members(self, room: str) -> List[WebSocket]:
+        raise NotImplementedError()
+
+    async def publish(
+            self, room: str, message: Message, exclude: Iterable[WebSocket] = (), timeout: Optional[float] = None
+    ) -> int:
+        raise NotImplementedError()
+
+    async def deliver(
+            self, room: str, message: Message, exclude: Iterable[WebSocket] = (), timeout: Optional[float] = None
+    ) -> int:
+        """
+        并发地把同一条已编码的消息发送给本地的成员, 返回发送成功的数量
+        发送超时或出错的连接会从所有房间中移除
+        """
+        excluded = {id(websocket) for websocket in exclude}
+        targets = [websocket for websocket in await self.members(room) if id(websocket) not in excluded]
+        if not targets:
+            return 0
+        results = await asyncio.gather(
+            *(asyncio.wait_for(websocket.send(message), timeout) for websocket in targets),
+            return_exceptions=True
+        )
+        sent = 0
+        for websocket, result in zip(targets, results):
+            if isinstance(result, BaseException):
+                for name in await self.rooms_of(websocket):
+                    await self.leave(name, websocket)
+            else:
+                sent += 1
+        return sent
+
+
+class LocalBackend(HubBackend):
+    """
+    进程内的后端, 只能广播到本进程内的连接
+    WebSocket是Mapping, 不能作为set的元素, 所以按id记录
+    """
+
+    def __init__(self):
+        self.rooms: Dict[str, Dict[int, WebSocket]] = {}
+        self.memberships: Dict[int, Set[str]] = {}
+
+    async def join(self, room: str, websocket: WebSocket) -> None:
+        self.rooms.setdefault(room, {})[id(websocket)] = websocket
+        self.memberships.setdefault(id(websocket), set()).add(room)
+
+    async def leave(self, room: str, websocket: WebSocket) -> None:
+        members = self.rooms.get(room)
+        if members is not None:
+            members.pop(id(websocket), None)
+            if not members:
+                del self.rooms[room]
+        rooms = self.memberships.get(id(websocket))
+        if rooms is not None:
+            rooms.discard(room)
+            if not rooms:
+                del self.memberships[id(websocket)]
+
+    async def rooms_of(self, websocket: WebSocket) -> List[str]:
+        return list(self.memberships.get(id(websocket), ()))
+
+    async def members(self, room: str) -> List[WebSocket]:
+        return list(self.rooms.get(room, {}).values())
+
+    async def publish(
+            self, room: str, message: Message, exclude: Iterable[WebSocket] = (), timeout: Optional[float] = None
+    ) -> int:
+        return await self.deliver(room, message, exclude, timeout)
+
+
+class Hub:
+    """
+    例:
+    class Chat(WebSocketBase, path="/chat", router=router, hub=Hub(timeout=1.0)):
+        async def on_receive(self, data):
+            await self.join(data["room"])
+            await self.broadcast(data["text"], room=data["room"])
+
+    WebSocket连接的注册表, 每个WebSocketBase的子类默认拥有一个
+    连接在on_connect之后自动加入, 断开之后自动离开所有房间
+    ALL("")房间包含全部连接, 其余房间通过join/leave手动管理
+    """
+
+    def __init__(self, backend: Optional[HubBackend] = None, timeout: Optional[float] = 5.0):
+        self.backend = backend or LocalBackend()
+        self.timeout = timeout
+
+    async def join(self, websocket: WebSocket, room: str = ALL) -> None:
+        await self.backend.join(room, websocket)
+
+    async def leave(self, websocket: WebSocket, room: Optional[str] = None) -> None:
+        """room为None时离开所有房间"""
+        rooms = await self.backend.rooms_of(websocket) if room is None else [room]
+        for name in rooms:
+            await self.backend.leave(name, websocket)
+
+    async def members(self, room: str = ALL) -> List[WebSocket]:
+        return await self.backend.members(room)
+
+    async def broadcast(
+            self,
+            data: Any,
+            room: str = ALL,
+            *,
+            encoding: Union[None, str, Codec] = None,
+            exclude: Iterable[WebSocket] = (),
+            timeout: Optional[float] = None,
+    ) -> int:
+        """
+        用encoding对应的Codec只编码一次, 并发地发送给房间内的所有连接(exclude除外), 返回本地发送成功的数量
+        每次发送的超时为timeout, 默认使用Hub的timeout
+        """
+        message = get_codec(encoding).encode(data)
+        return await self.backend.publish(room, message, exclude, self.timeout if timeout is None else timeout)